@@ -11,8 +11,21 @@ from datetime import datetime
 from gtts import gTTS
 import pyttsx3
 from pydub import AudioSegment, effects, silence
+from pydub.utils import mediainfo, audioop
 import re
 import time
+import traceback
+import math
+import heapq
+import itertools
+import wave
+import hashlib
+import shutil
+import unicodedata
+import queue
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     from elevenlabs.client import ElevenLabs
@@ -26,16 +39,53 @@ try:
 except ImportError:
     COQUI_AVAILABLE = False
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
 CHAR_LIMIT = 950
 LANG = "pl"
 SUPPORTED_FORMATS = ["ogg", "mp3", "wav"]
+AUDIO_EXTENSIONS = (".ogg", ".mp3", ".wav")
 DEFAULT_FORMAT = "ogg"
 CPU_THREADS = os.cpu_count() or 8
 DEFAULT_SETTINGS_FILE = "speakvault_settings.json"
 COQUI_MODEL = "tts_models/pl/glow-tts"
+DEFAULT_QUEUE_FILE = "speakvault_queue.json"
+QUEUE_SECRET_KEYS = ("eleven_api_key",)  # nie trafiają do pliku kolejki – przy przywracaniu brane z profilu
+# Maksymalna liczba równoległych zadań na silnik (limity API / zasoby lokalne)
+ENGINE_CONCURRENCY = {
+    "Google TTS": 1,
+    "Windows TTS": 1,
+    "ElevenLabs": 2,
+    "Coqui TTS": 1,
+    "batch": max(1, CPU_THREADS // 2),
+}
+DEFAULT_ENCODE_WORKERS = max(1, min(4, CPU_THREADS))
+# Ustawienia kodeka dla każdego formatu (nadpisywane kluczem "codec_settings" w profilu ustawień).
+# quality = VBR (-q:a), bitrate ma pierwszeństwo przed quality, sample_rate 0 = bez zmiany,
+# compression_level dla mp3: wyższa wartość = szybsze kodowanie.
+DEFAULT_CODEC_SETTINGS = {
+    "ogg": {"codec": "libvorbis", "bitrate": "", "quality": 4, "sample_rate": 0},
+    "mp3": {"codec": "libmp3lame", "bitrate": "", "quality": 4, "sample_rate": 0, "compression_level": 5},
+    "wav": {"sample_rate": 0},
+}
+DEFAULT_LOUDNESS_TARGET = -23.0  # LUFS (EBU R128)
+LOUDNESS_PEAK_CEILING = -1.0  # dBFS – normalizacja nie podbija szczytów ponad ten poziom
+DEFAULT_LOUDNESS_CACHE_FILE = "speakvault_loudness.json"
+LOUDNESS_CACHE_LIMIT = 20000
+WINDOWS_TTS_BATCH = 50  # tyle wypowiedzi kolejkujemy w silniku pyttsx3 na jedno runAndWait
+DEFAULT_DSP_WORKERS = max(1, min(2, CPU_THREADS))
+DEFAULT_PIPELINE_DEPTH = 8  # rozmiar kolejki przed każdym etapem potoku
+STREAM_WINDOW_MS = 20000  # długość okna w trybie strumieniowym batch – pamięć nie zależy od długości pliku
+STREAM_SILENCE_STEP_MS = 10
 
 stop_event = threading.Event()
-event_log = []
+EVENT_LOG_LIMIT = 5000  # dziennik zdarzeń w pamięci – starsze wpisy wypadają (tryby bez GUI działają tygodniami)
+event_log = deque(maxlen=EVENT_LOG_LIMIT)
+_job_tags = itertools.count(1)
 
 def log_event(msg):
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -53,13 +103,21 @@ def split_text(text, limit):
     if temp: result.append(temp.strip())
     return result
 
+def normalize_chunk(text):
+    # Klucz do wykrywania powtórzeń: ta sama treść niezależnie od białych znaków i zapisu Unicode
+    return unicodedata.normalize("NFC", " ".join(text.split()))
+
 def get_sequential_filename(folder, prefix, ext, start=1):
+    # Nazwa zajmowana od razu pustym plikiem (tworzenie wyłączne) – równoległe zadania, także z innych
+    # procesów, nie dostaną tej samej nazwy, a po usunięciu plików numeracja zaczyna się od nowa
     idx = start
     while True:
         filename = os.path.join(folder, f"{prefix} ({idx}).{ext}")
-        if not os.path.exists(filename):
-            return filename, idx
-        idx += 1
+        try:
+            with open(filename, "xb"):
+                return filename, idx
+        except FileExistsError:
+            idx += 1
 
 def read_text_file_autoencoding(path):
     encodings = ['utf-8', 'cp1250', 'windows-1250', 'latin2', 'iso8859_2']
@@ -165,9 +223,542 @@ def safe_gtts(text, lang, filename, retries=5):
                 return False
     return False
 
-def generate_audio_task(task, log, set_last_audio=None):
+def codec_settings_for(fmt, overrides=None):
+    settings = dict(DEFAULT_CODEC_SETTINGS.get(fmt, {}))
+    if overrides and isinstance(overrides.get(fmt), dict):
+        settings.update(overrides[fmt])
+    return settings
+
+def ffmpeg_codec_args(fmt, codec_settings=None):
+    cs = codec_settings_for(fmt, codec_settings)
+    args = []
+    if cs.get("codec"):
+        args += ["-acodec", cs["codec"]]
+    if cs.get("bitrate"):
+        args += ["-b:a", str(cs["bitrate"])]
+    elif cs.get("quality") not in (None, ""):
+        args += ["-q:a", str(cs["quality"])]
+    if cs.get("compression_level") not in (None, ""):
+        args += ["-compression_level", str(cs["compression_level"])]
+    if cs.get("sample_rate"):
+        args += ["-ar", str(int(cs["sample_rate"]))]
+    return args
+
+def export_audio(segment, filename, fmt, codec_settings=None):
+    if fmt == "wav":
+        # WAV zapisujemy natywnie – bez uruchamiania ffmpeg
+        sample_rate = codec_settings_for(fmt, codec_settings).get("sample_rate")
+        if sample_rate:
+            segment = segment.set_frame_rate(int(sample_rate))
+        segment.export(filename, format="wav")
+    else:
+        segment.export(filename, format=fmt, parameters=ffmpeg_codec_args(fmt, codec_settings))
+    return filename
+
+class EncoderPool:
+    # Równoległe kodowanie plików wyjściowych; w kolejce czeka najwyżej 2x tyle segmentów, ile jest wątków
+    def __init__(self, fmt, codec_settings=None, workers=DEFAULT_ENCODE_WORKERS, log=None):
+        workers = max(1, int(workers))
+        self.fmt = fmt
+        self.codec_settings = codec_settings
+        self.log = log
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(workers * 2)
+
+    def submit(self, segment, filename, on_done=None):
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(self._encode, segment, filename, on_done)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda f: self.slots.release())
+        return future
+
+    def _encode(self, segment, filename, on_done):
+        try:
+            export_audio(segment, filename, self.fmt, self.codec_settings)
+        except Exception as e:
+            if os.path.exists(filename) and os.path.getsize(filename) == 0:
+                os.remove(filename)
+            if self.log:
+                self.log(f"Błąd zapisu {os.path.basename(filename)}: {e}")
+            raise
+        if on_done:
+            on_done(filename)
+        return filename
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+class StreamEncoder:
+    # Jeden długo działający koder dla całego scalonego pliku: PCM kolejnych segmentów
+    # trafia od razu do ffmpeg (lub natywnie do WAV), bez sklejania całości w pamięci.
+    def __init__(self, filename, fmt, codec_settings=None):
+        self.filename = filename
+        self.fmt = fmt
+        self.codec_settings = codec_settings
+        self.params = None
+        self.proc = None
+        self.wav = None
+        self.duration_ms = 0
+
+    def _open(self, segment):
+        sample_rate = codec_settings_for(self.fmt, self.codec_settings).get("sample_rate")
+        self.params = (int(sample_rate) if sample_rate else segment.frame_rate, segment.channels, segment.sample_width)
+        rate, channels, width = self.params
+        if self.fmt == "wav":
+            self.wav = wave.open(self.filename, "wb")
+            self.wav.setnchannels(channels)
+            self.wav.setsampwidth(width)
+            self.wav.setframerate(rate)
+            return
+        pcm = {1: "u8", 2: "s16le", 3: "s24le", 4: "s32le"}[width]
+        cmd = [AudioSegment.converter, "-y", "-loglevel", "error",
+               "-f", pcm, "-ar", str(rate), "-ac", str(channels), "-i", "pipe:0"]
+        cmd += ffmpeg_codec_args(self.fmt, self.codec_settings) + ["-f", self.fmt, self.filename]
+        flags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.DEVNULL, creationflags=flags)
+
+    def write(self, segment):
+        if self.params is None:
+            self._open(segment)
+        rate, channels, width = self.params
+        segment = segment.set_frame_rate(rate).set_channels(channels).set_sample_width(width)
+        if self.wav is not None:
+            self.wav.writeframesraw(segment.raw_data)
+        else:
+            self.proc.stdin.write(segment.raw_data)
+        self.duration_ms += len(segment)
+
+    def close(self):
+        if self.wav is not None:
+            self.wav.close()
+        elif self.proc is not None:
+            self.proc.stdin.close()
+            code = self.proc.wait()
+            if code != 0:
+                raise RuntimeError(f"ffmpeg zakończył kodowanie z kodem {code}")
+        return self.duration_ms > 0
+
+def _k_weighting_power(rate, n_fft):
+    # |H(f)|^2 filtra K z ITU-R BS.1770 (półka wysokotonowa + filtr górnoprzepustowy) w punktach rfft
+    z1 = np.exp(-1j * 2 * np.pi * np.fft.rfftfreq(n_fft, 1.0 / rate) / rate)
+    z2 = z1 * z1
+
+    def biquad_power(b, a):
+        return np.abs((b[0] + b[1] * z1 + b[2] * z2) / (a[0] + a[1] * z1 + a[2] * z2)) ** 2
+
+    A = 10 ** (4.0 / 40)
+    w0 = 2 * np.pi * 1500.0 / rate
+    cw, sa = np.cos(w0), 2 * np.sqrt(A) * np.sin(w0) / (2 / np.sqrt(2))
+    shelf = biquad_power(
+        [A * ((A + 1) + (A - 1) * cw + sa), -2 * A * ((A - 1) + (A + 1) * cw), A * ((A + 1) + (A - 1) * cw - sa)],
+        [(A + 1) - (A - 1) * cw + sa, 2 * ((A - 1) - (A + 1) * cw), (A + 1) - (A - 1) * cw - sa])
+    w0 = 2 * np.pi * 38.0 / rate
+    cw, alpha = np.cos(w0), np.sin(w0) / (2 * 0.5)
+    high_pass = biquad_power([(1 + cw) / 2, -(1 + cw), (1 + cw) / 2], [1 + alpha, -2 * cw, 1 - alpha])
+    return shelf * high_pass
+
+def segment_samples(segment):
+    if segment.sample_width == 3:
+        segment = segment.set_sample_width(4)
+    dtype = {1: np.int8, 2: np.int16, 4: np.int32}[segment.sample_width]
+    samples = np.frombuffer(segment.raw_data, dtype=dtype).reshape(-1, segment.channels)
+    return samples.astype(np.float64) / float(1 << (8 * segment.sample_width - 1))
+
+def loudness_block_powers(samples, rate):
+    # Średnia moc ważona filtrem K w podblokach 100 ms (dla każdego kanału), liczona
+    # w dziedzinie częstotliwości (Parseval) – całość wektorowo, bez pętli po próbkach
+    step = max(1, int(rate * 0.1))
+    count = len(samples) // step
+    if count == 0:
+        return np.zeros((0, samples.shape[1]))
+    blocks = samples[:count * step].reshape(count, step, samples.shape[1])
+    spectrum = np.abs(np.fft.rfft(blocks, axis=1)) ** 2
+    weights = np.full(spectrum.shape[1], 2.0)
+    weights[0] = 1.0
+    if step % 2 == 0:
+        weights[-1] = 1.0
+    weights *= _k_weighting_power(rate, step)
+    return np.einsum("bfc,f->bc", spectrum, weights) / (step * step)
+
+def gated_loudness(block_powers):
+    # Bramkowanie BS.1770: bloki 400 ms z krokiem 100 ms, próg bezwzględny -70 LUFS i względny -10 LU
+    if len(block_powers) == 0:
+        return None
+    window = min(4, len(block_powers))
+    z = np.stack([np.convolve(block_powers[:, c], np.ones(window) / window, mode="valid")
+                  for c in range(block_powers.shape[1])], axis=1).sum(axis=1)
+    with np.errstate(divide="ignore"):
+        levels = -0.691 + 10 * np.log10(z)
+    gated = z[levels > -70.0]
+    if len(gated) == 0:
+        return None
+    relative = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+    gated = z[(levels > -70.0) & (levels > relative)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+def measure_loudness(segment):
+    if not NUMPY_AVAILABLE or len(segment) == 0:
+        return None
+    return gated_loudness(loudness_block_powers(segment_samples(segment), segment.frame_rate))
+
+class LoudnessCache:
+    # Zapamiętane pomiary głośności (LUFS) – ponowne uruchomienie nie analizuje niezmienionych plików
+    def __init__(self, path=DEFAULT_LOUDNESS_CACHE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        data = load_settings(path) if path else {}
+        self.values = data if isinstance(data, dict) else {}
+
+    def measure(self, segment, key=None):
+        if key is None:
+            key = "pcm:%d:%d:%d:%s" % (segment.frame_rate, segment.channels, segment.sample_width,
+                                       hashlib.sha1(segment.raw_data).hexdigest())
+        return self.lookup(key, lambda: measure_loudness(segment))
+
+    def lookup(self, key, compute):
+        with self.lock:
+            if key in self.values:
+                return self.values[key]
+        value = compute()
+        with self.lock:
+            self.values[key] = value
+            while len(self.values) > LOUDNESS_CACHE_LIMIT:
+                del self.values[next(iter(self.values))]
+        return value
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            values = dict(self.values)
+        # Zapis do pliku tymczasowego i podmiana – równoległe zadania nie zostawią uciętego JSON-a
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(values, f)
+            os.replace(tmp, self.path)
+        except Exception as e:
+            log_event(f"Błąd zapisu pomiarów głośności: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+_loudness_cache = None
+_loudness_cache_lock = threading.Lock()
+
+def get_loudness_cache():
+    global _loudness_cache
+    with _loudness_cache_lock:
+        if _loudness_cache is None:
+            _loudness_cache = LoudnessCache()
+        return _loudness_cache
+
+def normalize_loudness(segment, target=DEFAULT_LOUDNESS_TARGET, key=None, log=None):
+    # Dwuprzebiegowo: pomiar zintegrowanej głośności (z pamięci podręcznej), potem jedna zmiana wzmocnienia
+    if not NUMPY_AVAILABLE:
+        if log:
+            log("Moduł numpy nie zainstalowany – pomijam normalizację głośności! pip install numpy")
+        return segment
+    measured = get_loudness_cache().measure(segment, key)
+    if measured is None:
+        return segment
+    change = target - measured
+    if change > LOUDNESS_PEAK_CEILING - segment.max_dBFS:
+        change = LOUDNESS_PEAK_CEILING - segment.max_dBFS
+    if log:
+        log(f"Głośność: {measured:.1f} LUFS → {measured + change:.1f} LUFS (zmiana {change:+.1f} dB)")
+    return segment.apply_gain(change)
+
+class NormalizedMerge:
+    # Scalanie z normalizacją całości w dwóch przebiegach: segmenty trafiają na bieżąco do tymczasowego
+    # WAV, a moce bloków 100 ms i szczyt są sumowane po drodze; przy zamknięciu jedna zmiana wzmocnienia
+    # i kodowanie oknami z pliku tymczasowego – pamięć nie zależy od długości scalonego pliku
+    def __init__(self, filename, fmt, codec_settings=None, target=DEFAULT_LOUDNESS_TARGET, log=None):
+        self.filename = filename
+        self.fmt = fmt
+        self.codec_settings = codec_settings
+        self.target = target
+        self.log = log
+        folder, name = os.path.split(filename)
+        self.tmp = os.path.join(folder, f"_tmp_norm_{os.path.splitext(name)[0]}.wav")
+        self.wav = None
+        self.params = None
+        self.powers = []
+        self.rest = None
+        self.peak = 0
+
+    def write(self, segment):
+        if self.params is None:
+            self.params = (segment.frame_rate, segment.channels, segment.sample_width)
+            self.wav = wave.open(self.tmp, "wb")
+            self.wav.setnchannels(segment.channels)
+            self.wav.setsampwidth(segment.sample_width)
+            self.wav.setframerate(segment.frame_rate)
+        rate, channels, width = self.params
+        segment = segment.set_frame_rate(rate).set_channels(channels).set_sample_width(width)
+        self.wav.writeframesraw(segment.raw_data)
+        self.peak = max(self.peak, segment.max)
+        if NUMPY_AVAILABLE:
+            samples = segment_samples(segment)
+            if self.rest is not None:
+                samples = np.concatenate([self.rest, samples])
+            step = max(1, int(rate * 0.1))
+            used = len(samples) // step * step
+            self.powers.append(loudness_block_powers(samples[:used], rate))
+            self.rest = samples[used:]
+
+    def close(self):
+        if self.wav is None:
+            return False
+        self.wav.close()
+        try:
+            rate, channels, width = self.params
+            change = 0.0
+            measured = gated_loudness(np.concatenate(self.powers)) if self.powers else None
+            if not NUMPY_AVAILABLE:
+                if self.log:
+                    self.log("Moduł numpy nie zainstalowany – pomijam normalizację głośności! pip install numpy")
+            elif measured is not None:
+                max_dbfs = 20 * math.log10(self.peak / float(1 << (8 * width - 1))) if self.peak else -float("inf")
+                change = min(self.target - measured, LOUDNESS_PEAK_CEILING - max_dbfs)
+                if self.log:
+                    self.log(f"Głośność: {measured:.1f} LUFS → {measured + change:.1f} LUFS (zmiana {change:+.1f} dB)")
+            encoder = StreamEncoder(self.filename, self.fmt, self.codec_settings)
+            frames = max(1, rate * STREAM_WINDOW_MS // 1000)
+            try:
+                with wave.open(self.tmp, "rb") as src:
+                    while True:
+                        data = src.readframes(frames)
+                        if not data:
+                            break
+                        segment = AudioSegment(data=data, sample_width=width, frame_rate=rate, channels=channels)
+                        encoder.write(segment.apply_gain(change) if change else segment)
+            finally:
+                result = encoder.close()
+            return result
+        finally:
+            self.powers = []
+            self.rest = None
+            if os.path.exists(self.tmp):
+                os.remove(self.tmp)
+
+class EspeakCliEngine:
+    # Zastępczy sterownik bez GUI (Linux, serwery CI): udaje API pyttsx3 i renderuje przez espeak-ng/espeak
+    def __init__(self):
+        self.command = shutil.which("espeak-ng") or shutil.which("espeak")
+        if not self.command:
+            raise RuntimeError("Brak pyttsx3 oraz espeak-ng/espeak – nie można uruchomić Windows TTS")
+        self.properties = {"voice": "", "rate": 175}
+        self.queue = []
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+    def getProperty(self, name):
+        return self.properties.get(name)
+
+    def save_to_file(self, text, filename):
+        self.queue.append((text, filename))
+
+    def runAndWait(self):
+        queue, self.queue = self.queue, []
+        for text, filename in queue:
+            cmd = [self.command, "-w", filename, "-s", str(self.properties.get("rate", 175))]
+            if self.properties.get("voice"):
+                cmd += ["-v", self.properties["voice"]]
+            subprocess.run(cmd + ["--", text], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+class WindowsTTSBatch:
+    # Jeden długo żyjący silnik pyttsx3 na całe zadanie: wiele save_to_file w kolejce i jedna pętla
+    # runAndWait na paczkę, zamiast init/runAndWait/del dla każdego fragmentu. pyttsx3 nie jest
+    # bezpieczny wątkowo, więc silnik tworzy i obsługuje wyłącznie własny wątek obiektu.
+    def __init__(self, voice_id="", driver_name=None):
+        self.voice_id = voice_id
+        self.driver_name = driver_name
+        self.engine = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def _get_engine(self):
+        if self.engine is None:
+            try:
+                self.engine = pyttsx3.init(self.driver_name) if self.driver_name else pyttsx3.init()
+            except Exception:
+                if sys.platform == "win32":
+                    raise
+                self.engine = EspeakCliEngine()
+            if self.voice_id:
+                self.engine.setProperty('voice', self.voice_id)
+        return self.engine
+
+    def render(self, items):
+        return self.executor.submit(self._render, items).result()
+
+    def _render(self, items):
+        engine = self._get_engine()
+        for text, filename in items:
+            engine.save_to_file(text, filename)
+        engine.runAndWait()
+        return [os.path.exists(fn) and os.path.getsize(fn) > 0 for _, fn in items]
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+_coqui_models = {}
+_eleven_clients = {}
+_engine_cache_lock = threading.Lock()
+_engine_slots = {name: threading.BoundedSemaphore(n) for name, n in ENGINE_CONCURRENCY.items()}
+
+def get_engine_slot(engine):
+    # Wspólny dla całego procesu limit równoczesnych wywołań silnika (ENGINE_CONCURRENCY) –
+    # niezależnie od tego, ile zadań i wątków syntezy działa naraz
+    with _engine_cache_lock:
+        return _engine_slots.setdefault(engine, threading.BoundedSemaphore(1))
+
+def get_coqui_model(model_name=COQUI_MODEL):
+    # Model ładowany raz na proces – kolejne fragmenty i zadania korzystają z rozgrzanego modelu
+    with _engine_cache_lock:
+        if model_name not in _coqui_models:
+            _coqui_models[model_name] = CoquiTTS(model_name=model_name, progress_bar=False, gpu=False)
+        return _coqui_models[model_name]
+
+def get_eleven_client(api_key):
+    with _engine_cache_lock:
+        if api_key not in _eleven_clients:
+            _eleven_clients[api_key] = ElevenLabs(api_key=api_key)
+        return _eleven_clients[api_key]
+
+def synthesize_fragment(task, chunk, tmp, log, windows_tts=None):
+    engine = task['engine']
+    fmt = task['format']
+    if engine == "Google TTS":
+        ok = safe_gtts(chunk, LANG, tmp, retries=5)
+        return ok
+    elif engine == "Windows TTS":
+        if windows_tts is not None:
+            return windows_tts.render([(chunk, tmp)])[0]
+        windows_tts = WindowsTTSBatch(task.get('voice_id', ""), task.get("windows_tts_driver"))
+        try:
+            return windows_tts.render([(chunk, tmp)])[0]
+        finally:
+            windows_tts.close()
+    elif engine == "ElevenLabs":
+        if not ELEVENLABS_AVAILABLE:
+            log("Moduł elevenlabs nie zainstalowany! pip install elevenlabs")
+            return False
+        client = get_eleven_client(task.get('eleven_api_key', ""))
+        result = client.text_to_speech.convert(
+            voice_id=task.get('eleven_voice_id', ""), model_id="eleven_turbo_v2_5", text=chunk,
+            output_format="opus_48000_64" if fmt == "ogg" else fmt
+        )
+        with open(tmp, "wb") as f:
+            for part in result:
+                f.write(part)
+        return True
+    elif engine == "Coqui TTS":
+        if not COQUI_AVAILABLE:
+            log("Moduł Coqui TTS nie zainstalowany! pip install TTS")
+            return False
+        tts = get_coqui_model()
+        kwargs = {}
+        if task.get('coqui_speaker'):
+            kwargs['speaker'] = task['coqui_speaker']
+        tts.tts_to_file(text=chunk, file_path=tmp, **kwargs)
+        if fmt != "wav":
+            segment = AudioSegment.from_file(tmp)
+            new_tmp = tmp.replace(".wav", f".{fmt}")
+            segment.export(new_tmp, format=fmt)
+            os.remove(tmp)
+            tmp = new_tmp
+        return True
+    return False
+
+def apply_voice_effects(segment, tempo=1.0, pitch=1.0, gain=1.0, loudness_target=None):
+    if tempo != 1.0:
+        segment = segment.speedup(playback_speed=tempo)
+    if pitch != 1.0:
+        segment = segment._spawn(segment.raw_data, overrides={
+            "frame_rate": int(segment.frame_rate * pitch)
+        }).set_frame_rate(segment.frame_rate)
+    if loudness_target is not None:
+        segment = normalize_loudness(segment, loudness_target)
+    elif gain != 1.0:
+        segment += (20 * (gain-1))
+    return segment
+
+class PipelineStage:
+    # Etap potoku generowania: własne wątki, ograniczona kolejka wejściowa (backpressure)
+    # i statystyki głębokości kolejki oraz wykorzystania wątków do raportu po zadaniu
+    def __init__(self, name, func, workers, depth, emit, cancel_event):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.depth = max(1, int(depth))
+        self.inbox = queue.Queue(maxsize=self.depth)
+        self.emit = emit
+        self.cancel_event = cancel_event
+        self.lock = threading.Lock()
+        self.busy = 0.0
+        self.max_depth = 0
+        self.depth_sum = 0
+        self.samples = 0
+        self.started = time.perf_counter()
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(self.workers)]
+        for t in self.threads:
+            t.start()
+
+    def put(self, item):
+        # Czeka, gdy kolejka jest pełna, ale reaguje na zatrzymanie zadania
+        while True:
+            try:
+                self.inbox.put(item, timeout=0.2)
+                break
+            except queue.Full:
+                if self.cancel_event.is_set():
+                    return False
+        with self.lock:
+            depth = self.inbox.qsize()
+            self.max_depth = max(self.max_depth, depth)
+            self.depth_sum += depth
+            self.samples += 1
+        return True
+
+    def close(self):
+        for _ in self.threads:
+            self.inbox.put(None)
+
+    def join(self):
+        for t in self.threads:
+            t.join()
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            if item is None:
+                return
+            t0 = time.perf_counter()
+            results = self.func(item)
+            with self.lock:
+                self.busy += time.perf_counter() - t0
+            for result in results:
+                self.emit(result)
+
+    def snapshot(self):
+        return f"{self.name} {self.inbox.qsize()}/{self.depth}"
+
+    def report(self):
+        wall = max(time.perf_counter() - self.started, 1e-6)
+        average = self.depth_sum / self.samples if self.samples else 0.0
+        return (f"{self.name}: {self.workers} wątk., wykorzystanie {self.busy / (wall * self.workers):.0%}, "
+                f"kolejka śr. {average:.1f} / maks. {self.max_depth} z {self.depth}")
+
+def generate_audio_task(task, log, set_last_audio=None, cancel_event=None):
     import traceback
-    stop_event.clear()
+    if cancel_event is None:
+        stop_event.clear()
+        cancel_event = stop_event
     path = task['file']
     start = int(task['start_line'])
     end = int(task['end_line'])
@@ -177,13 +768,19 @@ def generate_audio_task(task, log, set_last_audio=None):
     merge = task['merge']
     srt_1s_ciszy = task.get("srt_1s_ciszy", False)
     tts_voice_id = task.get('voice_id', "")
-    eleven_api_key = task.get('eleven_api_key', "")
-    eleven_voice_id = task.get('eleven_voice_id', "")
-    coqui_speaker = task.get('coqui_speaker', "")
     tempo = float(task.get("tempo", 1.0))
     pitch = float(task.get("pitch", 1.0))
     gain = float(task.get("gain", 1.0))
     global_stretch = task.get('global_stretch', False)
+    name_by_label = task.get("name_by_label", False)
+    codec_settings = task.get("codec_settings") or {}
+    encode_workers = int(task.get("encode_workers", DEFAULT_ENCODE_WORKERS))
+    loudness = bool(task.get("loudness_normalize", False))
+    loudness_target = float(task.get("loudness_target", DEFAULT_LOUDNESS_TARGET))
+    # ElevenLabs zwraca już zakodowany plik w docelowym formacie – bez zmian tempa/tonu/głośności
+    # zapisujemy go bez dekodowania i ponownego kodowania
+    passthrough = (task.get("eleven_passthrough", True) and engine == "ElevenLabs" and not merge and not loudness
+                   and tempo == 1.0 and pitch == 1.0 and gain == 1.0)
 
     if not out_dir or not os.path.isdir(out_dir):
         log("‼️ Wybierz folder wyjściowy audio przed startem!")
@@ -191,119 +788,287 @@ def generate_audio_task(task, log, set_last_audio=None):
         return
 
     os.makedirs(out_dir, exist_ok=True)
-    lines = parse_file(path)
+    lines = task["lines"] if task.get("lines") is not None else parse_file(path)
     total_lines = len(lines)
     last_file = None
-
-    def process_tts_fragment(chunk, tmp):
-        if engine == "Google TTS":
-            ok = safe_gtts(chunk, LANG, tmp, retries=5)
-            return ok
-        elif engine == "Windows TTS":
-            tts_engine = pyttsx3.init()
-            if tts_voice_id:
-                tts_engine.setProperty('voice', tts_voice_id)
-            tts_engine.save_to_file(chunk, tmp)
-            tts_engine.runAndWait()
-            del tts_engine
-            return True
-        elif engine == "ElevenLabs":
-            if not ELEVENLABS_AVAILABLE:
-                log("Moduł elevenlabs nie zainstalowany! pip install elevenlabs")
-                return False
-            client = ElevenLabs(api_key=eleven_api_key)
-            result = client.text_to_speech.convert(
-                voice_id=eleven_voice_id, model_id="eleven_turbo_v2_5", text=chunk,
-                output_format="opus_48000_64" if fmt == "ogg" else fmt
-            )
-            with open(tmp, "wb") as f:
-                for part in result:
-                    f.write(part)
-            return True
-        elif engine == "Coqui TTS":
-            if not COQUI_AVAILABLE:
-                log("Moduł Coqui TTS nie zainstalowany! pip install TTS")
-                return False
-            tts = CoquiTTS(model_name=COQUI_MODEL, progress_bar=False, gpu=False)
-            kwargs = {}
-            if coqui_speaker:
-                kwargs['speaker'] = coqui_speaker
-            tts.tts_to_file(text=chunk, file_path=tmp, **kwargs)
-            if fmt != "wav":
-                segment = AudioSegment.from_file(tmp)
-                new_tmp = tmp.replace(".wav", f".{fmt}")
-                segment.export(new_tmp, format=fmt)
-                os.remove(tmp)
-                tmp = new_tmp
-            return True
-        return False
+    windows_tts = WindowsTTSBatch(tts_voice_id, task.get("windows_tts_driver")) if engine == "Windows TTS" else None
 
     # Obsługa TXT/CSV/SRT nie-merge i merge
     lines = lines[start-1:end] if end > 0 else lines[start-1:]
-    full_audio = AudioSegment.silent(duration=0)
+    merged = None
     idx = 1
     last_file = None
     output_files = []
+    encoder_pool = None if merge else EncoderPool(fmt, codec_settings, encode_workers, log=log)
+
+    def saved(filename):
+        log(f"Zapisano: {os.path.basename(filename)}")
 
+    def next_output(label, part_i):
+        # Tryb obserwacji folderu nazywa pliki etykietą linii, żeby dało się je później odnaleźć
+        nonlocal idx
+        if name_by_label:
+            return os.path.join(out_dir, f"{label}_{part_i+1}.{fmt}")
+        output_filename, idx = get_sequential_filename(out_dir, "output1", fmt, idx)
+        idx += 1
+        return output_filename
+
+    plan = []
     for i, entry in enumerate(lines):
-        if path.lower().endswith('.srt'):
+        if len(entry) == 5:
             label, _, text, start_ms, end_ms = entry
         else:
             label, text = entry
         for part_i, chunk in enumerate(split_text(text, CHAR_LIMIT)):
-            # Check for stop before processing each chunk
-            if stop_event.is_set():
-                log("🛑 Zadanie zatrzymane przez użytkownika – zapisywanie dotychczasowego audio...")
-                if merge and len(full_audio) > 0:
-                    try:
-                        output_filename, _ = get_sequential_filename(out_dir, "output1", fmt)
-                        full_audio.export(output_filename, format=fmt)
-                        log(f"Zapisano częściowe scalone: {os.path.basename(output_filename)}")
-                        log_event(f"Częściowe zadanie TTS zakończone: {os.path.basename(output_filename)}")
-                        last_file = output_filename
-                        if set_last_audio:
-                            set_last_audio(output_filename)
-                    except Exception as e:
-                        log(f"Błąd przy zapisie częściowego scalonego: {e}")
-                        log_event(f"Błąd przy zapisie częściowego scalonego: {e}")
-                log("Przerywam dalsze przetwarzanie.")
-                return
-            percent = int((i+1) / total_lines * 100)
-            log(f"[{percent}%] {label}.{part_i+1}: {chunk[:40]}")
-            tmp = os.path.join(out_dir, f"_tmp_{label}_{part_i}.{fmt}")
+            plan.append((i, label, part_i, chunk, normalize_chunk(chunk)))
+
+    # Powtarzające się fragmenty syntezujemy raz; gotowe audio (lub plik) trzymamy do ostatniego wystąpienia
+    remaining = {}
+    if task.get("dedupe", True):
+        for item in plan:
+            remaining[item[4]] = remaining.get(item[4], 0) + 1
+    reuse = {}
+    saved_calls = saved_chars = 0
+    jobs, seen_keys = [], set()
+    for pos, item in enumerate(plan):
+        if not remaining or item[4] not in seen_keys:
+            seen_keys.add(item[4])
+            jobs.append(pos)
+    job_set = set(jobs)
+
+    # Znacznik zadania w nazwach plików tymczasowych – równoległe zadania (także z innego procesu)
+    # zapisujące do tego samego folderu nie nadpisują sobie fragmentów
+    job_tag = f"{os.getpid()}_{next(_job_tags)}"
+
+    def tmp_path(label, part_i):
+        return os.path.join(out_dir, f"_tmp_{job_tag}_{label}_{part_i}.{fmt}")
+
+    # Potok: synteza -> dekodowanie i efekty -> zapis/scalanie (w tym wątku, w kolejności linii).
+    # Etapy łączą ograniczone kolejki, a okno "window" ogranicza liczbę fragmentów w drodze,
+    # więc pamięć zależy od rozmiaru kolejek, a nie od długości skryptu.
+    results = {}
+    results_cond = threading.Condition()
+    if windows_tts is not None:
+        # Windows TTS: cała paczka fragmentów w jednym runAndWait na jednym silniku
+        synth_workers, group_size = 1, WINDOWS_TTS_BATCH
+    else:
+        synth_workers, group_size = int(task.get("synth_workers", ENGINE_CONCURRENCY.get(engine, 1))), 1
+    depth = int(task.get("pipeline_depth", DEFAULT_PIPELINE_DEPTH))
+    dsp_workers = int(task.get("dsp_workers", DEFAULT_DSP_WORKERS))
+    window = threading.BoundedSemaphore(max(2 * group_size, 2 * depth + synth_workers * group_size + dsp_workers + 2))
+
+    def deliver(result):
+        with results_cond:
+            results[result[0]] = result
+            results_cond.notify_all()
+
+    def synth_group(group):
+        items = [(pos, plan[pos][3], tmp_path(plan[pos][1], plan[pos][2])) for pos in group]
+        if cancel_event.is_set():
+            return [(pos, tmp, False, None) for pos, _, tmp in items]
+        try:
+            if windows_tts is not None:
+                log(f"Windows TTS: renderuję paczkę {len(items)} fragmentów")
+                with get_engine_slot(engine):
+                    oks = windows_tts.render([(chunk, tmp) for _, chunk, tmp in items])
+            else:
+                oks = []
+                for _, chunk, tmp in items:
+                    with get_engine_slot(engine):
+                        oks.append(synthesize_fragment(task, chunk, tmp, log))
+            return [(pos, tmp, ok, None) for (pos, _, tmp), ok in zip(items, oks)]
+        except Exception:
+            error = traceback.format_exc()
+            return [(pos, tmp, False, error) for pos, _, tmp in items]
+
+    def process_audio(result):
+        pos, tmp, ok, error = result
+        if not ok or passthrough or cancel_event.is_set():
+            return [(pos, tmp, ok, error, None)]
+        try:
+            segment = apply_voice_effects(AudioSegment.from_file(tmp), tempo, pitch, gain,
+                                          loudness_target if loudness else None)
+            os.remove(tmp)
+            return [(pos, tmp, True, None, segment)]
+        except Exception:
+            return [(pos, tmp, False, traceback.format_exc(), None)]
+
+    dsp = PipelineStage("dekodowanie/efekty", process_audio, dsp_workers, depth, deliver, cancel_event)
+    synth = PipelineStage("synteza", synth_group, synth_workers, depth, dsp.put, cancel_event)
+
+    def feed():
+        group = []
+        for pos in jobs:
+            while not window.acquire(timeout=0.2):
+                if cancel_event.is_set():
+                    break
+            if cancel_event.is_set():
+                break
+            group.append(pos)
+            if len(group) >= group_size:
+                synth.put(group)
+                group = []
+        if group and not cancel_event.is_set():
+            synth.put(group)
+        synth.close()
+        synth.join()
+        dsp.close()
+        dsp.join()
+        if cancel_event.is_set():
+            # Sprzątanie plików tymczasowych, których etap zapisu już nie odebrał
+            with results_cond:
+                leftovers = list(results.values())
+            for result in leftovers:
+                if os.path.exists(result[1]):
+                    os.remove(result[1])
+
+    def take_result(pos):
+        with results_cond:
+            while pos not in results:
+                if cancel_event.is_set():
+                    return None
+                results_cond.wait(0.2)
+            result = results.pop(pos)
+        window.release()
+        return result
+
+    def render_inline(label, part_i, chunk):
+        # Pierwsze wystąpienie powtórzonego fragmentu się nie udało – syntezujemy to wystąpienie osobno
+        # (Windows TTS: przez wątek silnika zadania, nigdy równolegle z etapem syntezy)
+        tmp = tmp_path(label, part_i)
+        with get_engine_slot(engine):
+            ok = synthesize_fragment(task, chunk, tmp, log, windows_tts)
+        if not ok or passthrough:
+            return (None, tmp, ok, None, None)
+        segment = apply_voice_effects(AudioSegment.from_file(tmp), tempo, pitch, gain,
+                                      loudness_target if loudness else None)
+        os.remove(tmp)
+        return (None, tmp, True, None, segment)
+
+    threading.Thread(target=feed, daemon=True).start()
+    output_busy = 0.0
+    output_started = time.perf_counter()
+
+    for pos, (i, label, part_i, chunk, key) in enumerate(plan):
+        # Check for stop before processing each chunk
+        if cancel_event.is_set():
+            log("🛑 Zadanie zatrzymane przez użytkownika – zapisywanie dotychczasowego audio...")
+            if encoder_pool:
+                encoder_pool.close()
+            if merged is not None:
+                try:
+                    merged.close()
+                    output_filename = merged.filename
+                    log(f"Zapisano częściowe scalone: {os.path.basename(output_filename)}")
+                    log_event(f"Częściowe zadanie TTS zakończone: {os.path.basename(output_filename)}")
+                    last_file = output_filename
+                    if set_last_audio:
+                        set_last_audio(output_filename)
+                except Exception as e:
+                    log(f"Błąd przy zapisie częściowego scalonego: {e}")
+                    log_event(f"Błąd przy zapisie częściowego scalonego: {e}")
+            log("Przerywam dalsze przetwarzanie.")
+            if windows_tts is not None:
+                windows_tts.close()
+            return
+        percent = int((i+1) / total_lines * 100)
+        if pos and pos % 50 == 0:
+            log(f"Potok: {synth.snapshot()}, {dsp.snapshot()}")
+        remaining[key] = remaining.get(key, 1) - 1
+        cached = None
+        if pos not in job_set:
+            cached = reuse.pop(key, None) if remaining[key] <= 0 else reuse.get(key)
+        if cached is not None:
+            log(f"[{percent}%] {label}.{part_i+1}: {chunk[:40]} (powtórzenie – bez syntezy)")
+            t0 = time.perf_counter()
             try:
-                ok = process_tts_fragment(chunk, tmp)
-                if not ok:
-                    log(f"Błąd TTS: nie udało się wygenerować fragmentu: {chunk[:40]}")
-                    continue
-                segment = AudioSegment.from_file(tmp)
-                if tempo != 1.0:
-                    segment = segment.speedup(playback_speed=tempo)
-                if pitch != 1.0:
-                    segment = segment._spawn(segment.raw_data, overrides={
-                        "frame_rate": int(segment.frame_rate * pitch)
-                    }).set_frame_rate(segment.frame_rate)
-                if gain != 1.0:
-                    segment += (20 * (gain-1))
                 if merge:
-                    full_audio += segment
+                    merged.write(cached["segment"])
                 else:
-                    output_filename, idx = get_sequential_filename(out_dir, "output1", fmt, idx)
-                    segment.export(output_filename, format=fmt)
-                    log(f"Zapisano: {os.path.basename(output_filename)}")
+                    if cached.get("future") is not None:
+                        cached["future"].result()
+                    output_filename = next_output(label, part_i)
+                    shutil.copyfile(cached["file"], output_filename)
+                    saved(output_filename)
                     last_file = output_filename
                     output_files.append(output_filename)
-                    idx += 1
-                os.remove(tmp)
+                saved_calls += 1
+                saved_chars += len(chunk)
+                continue
             except Exception as e:
-                log(f"Błąd: {e}")
-                import traceback; log(traceback.format_exc())
+                # Nieudany zapis pierwszego wystąpienia – syntezujemy ten fragment od nowa
+                log(f"Błąd ponownego użycia audio: {e}")
+            finally:
+                output_busy += time.perf_counter() - t0
+        log(f"[{percent}%] {label}.{part_i+1}: {chunk[:40]}")
+        t0 = None
+        try:
+            if pos in job_set:
+                result = take_result(pos)
+                if result is None:
+                    continue
+            else:
+                result = render_inline(label, part_i, chunk)
+            t0 = time.perf_counter()
+            _, tmp, ok, error, segment = result
+            if cancel_event.is_set():
+                if os.path.exists(tmp):
+                    os.remove(tmp)
                 continue
-
-    if merge and len(full_audio) > 0:
+            if error:
+                log(f"Błąd: {error.strip().splitlines()[-1]}")
+                log(error)
+                continue
+            if not ok:
+                log(f"Błąd TTS: nie udało się wygenerować fragmentu: {chunk[:40]}")
+                continue
+            if passthrough:
+                output_filename = next_output(label, part_i)
+                os.replace(tmp, output_filename)
+                saved(output_filename)
+                last_file = output_filename
+                output_files.append(output_filename)
+                if remaining.get(key, 0) > 0:
+                    reuse[key] = {"file": output_filename}
+                continue
+            if merge:
+                if merged is None:
+                    output_filename, _ = get_sequential_filename(out_dir, "output1", fmt)
+                    if loudness:
+                        merged = NormalizedMerge(output_filename, fmt, codec_settings, loudness_target, log)
+                    else:
+                        merged = StreamEncoder(output_filename, fmt, codec_settings)
+                merged.write(segment)
+                if remaining.get(key, 0) > 0:
+                    reuse[key] = {"segment": segment}
+            else:
+                output_filename = next_output(label, part_i)
+                future = encoder_pool.submit(segment, output_filename, saved)
+                last_file = output_filename
+                output_files.append(output_filename)
+                if remaining.get(key, 0) > 0:
+                    reuse[key] = {"file": output_filename, "future": future}
+        except Exception as e:
+            log(f"Błąd: {e}")
+            import traceback; log(traceback.format_exc())
+            continue
+        finally:
+            if t0 is not None:
+                output_busy += time.perf_counter() - t0
+
+    output_wall = max(time.perf_counter() - output_started, 1e-6)
+    for stage in (synth, dsp):
+        log(f"📊 {stage.report()}")
+    log(f"📊 zapis/scalanie: 1 wątek, wykorzystanie {output_busy / output_wall:.0%}")
+    if saved_calls:
+        log(f"♻️ Powtórzone fragmenty: pominięto {saved_calls} wywołań syntezy ({saved_chars} znaków)")
+        log_event(f"Deduplikacja TTS: pominięto {saved_calls} wywołań syntezy ({saved_chars} znaków)")
+    if encoder_pool:
+        encoder_pool.close()
+    if merged is not None:
         try:
-            output_filename, _ = get_sequential_filename(out_dir, "output1", fmt)
-            full_audio.export(output_filename, format=fmt)
+            merged.close()
+            output_filename = merged.filename
             log(f"Zapisano scalone: {os.path.basename(output_filename)}")
             log_event(f"Zadanie TTS zakończone: {os.path.basename(output_filename)}")
             last_file = output_filename
@@ -311,13 +1076,40 @@ def generate_audio_task(task, log, set_last_audio=None):
             log(f"Błąd przy scalaniu: {e}")
             log_event(f"Błąd przy scalaniu: {e}")
 
+    if windows_tts is not None:
+        windows_tts.close()
+    if loudness:
+        get_loudness_cache().save()
     if set_last_audio and last_file:
         set_last_audio(last_file)
 
-def batch_audio_task(files, outdir, speed, pitch, gain, silence_remove, fmt, start_s, end_s, log):
+def batch_audio_task(files, outdir, speed, pitch, gain, silence_remove, fmt, start_s, end_s, log, cancel_event=None,
+                     codec_settings=None, encode_workers=DEFAULT_ENCODE_WORKERS,
+                     loudness_normalize=False, loudness_target=DEFAULT_LOUDNESS_TARGET, streaming=False):
+    # Dekodowanie i efekty idą po kolei, kodowanie plików wyjściowych równolegle w puli;
+    # w trybie strumieniowym każdy plik przechodzi oknami prosto do kodera
+    encoder_pool = EncoderPool(fmt, codec_settings, encode_workers, log=log)
+    loudness = loudness_target if loudness_normalize else None
+    try:
+        _batch_audio_files(files, outdir, speed, pitch, gain, silence_remove, fmt, start_s, end_s, log, cancel_event, encoder_pool, loudness,
+                           streaming, codec_settings)
+    finally:
+        encoder_pool.close()
+        if loudness_normalize:
+            get_loudness_cache().save()
+
+def _batch_audio_files(files, outdir, speed, pitch, gain, silence_remove, fmt, start_s, end_s, log, cancel_event, encoder_pool, loudness=None,
+                       streaming=False, codec_settings=None):
     for i, path in enumerate(files):
+        if cancel_event is not None and cancel_event.is_set():
+            log("🛑 Batch zatrzymany przez użytkownika.")
+            return
         try:
             log(f"[{i+1}/{len(files)}] Otwieram: {os.path.basename(path)}")
+            if streaming:
+                _stream_audio_file(path, outdir, speed, pitch, gain, silence_remove, fmt, start_s, end_s, log, cancel_event,
+                                   codec_settings, loudness)
+                continue
             audio = AudioSegment.from_file(path)
             orig_len = len(audio)
             if start_s > 0 or end_s > 0:
@@ -326,7 +1118,8 @@ def batch_audio_task(files, outdir, speed, pitch, gain, silence_remove, fmt, sta
                 audio = audio[start_ms:end_ms]
                 log(f"Przycięto: {start_ms}ms - {end_ms}ms")
             if silence_remove:
-                audio = effects.normalize(audio)
+                if loudness is None:
+                    audio = effects.normalize(audio)
                 chunks = silence.split_on_silence(audio, min_silence_len=400, silence_thresh=audio.dBFS-24, keep_silence=50)
                 if chunks:
                     audio = sum(chunks)
@@ -337,14 +1130,303 @@ def batch_audio_task(files, outdir, speed, pitch, gain, silence_remove, fmt, sta
                 audio = audio._spawn(audio.raw_data, overrides={
                     "frame_rate": int(audio.frame_rate * pitch)
                 }).set_frame_rate(audio.frame_rate)
-            if gain != 1.0:
+            if loudness is not None:
+                stat = os.stat(path)
+                key = f"file:{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}:{start_s}:{end_s}:{silence_remove}:{speed}:{pitch}"
+                audio = normalize_loudness(audio, loudness, key, log)
+            elif gain != 1.0:
                 audio += (20 * (gain-1))
             output_filename, _ = get_sequential_filename(outdir, "output2", fmt)
-            audio.export(output_filename, format=fmt)
-            log(f"✔️ Zapisano: {output_filename}")
+            encoder_pool.submit(audio, output_filename, lambda fn: log(f"✔️ Zapisano: {fn}"))
         except Exception as e:
             log(f"❌ Błąd: {e}")
 
+def _read_wav_header(stream):
+    # Nagłówek WAV z potoku ffmpeg: rozmiary bloków są tam zastępcze, więc czytamy tylko "fmt " i dochodzimy do "data"
+    if stream.read(12)[:4] != b"RIFF":
+        raise RuntimeError("ffmpeg nie zdekodował pliku")
+    fmt = None
+    while True:
+        head = stream.read(8)
+        if len(head) < 8:
+            raise RuntimeError("ffmpeg nie zdekodował pliku")
+        chunk_id, size = head[:4], int.from_bytes(head[4:], "little")
+        if chunk_id == b"data":
+            if fmt is None:
+                raise RuntimeError("ffmpeg nie zdekodował pliku")
+            return fmt
+        data = stream.read(size + size % 2)
+        if chunk_id == b"fmt ":
+            fmt = (int.from_bytes(data[4:8], "little"), int.from_bytes(data[2:4], "little"), int.from_bytes(data[14:16], "little") // 8)
+
+def iter_audio_windows(path, start_s=0, end_s=0, window_ms=STREAM_WINDOW_MS, sample_rate=None, cancel_event=None):
+    # Dekoduje tylko zakres start–koniec (ffmpeg przewija -ss przed otwarciem) i oddaje okna
+    # AudioSegment o stałej długości; proces ffmpeg jest zamykany także przy przerwaniu
+    cmd = [AudioSegment.converter, "-loglevel", "error"]
+    if start_s > 0:
+        cmd += ["-ss", f"{start_s:.3f}"]
+    cmd += ["-i", path]
+    if end_s > 0:
+        cmd += ["-t", f"{max(0.0, end_s - max(0.0, start_s)):.3f}"]
+    cmd += ["-vn", "-acodec", "pcm_s16le"]
+    if sample_rate:
+        cmd += ["-ar", str(int(sample_rate))]
+    cmd += ["-f", "wav", "pipe:1"]
+    flags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+    proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, creationflags=flags)
+    try:
+        rate, channels, width = _read_wav_header(proc.stdout)
+        size = max(1, rate * window_ms // 1000) * channels * width
+        while cancel_event is None or not cancel_event.is_set():
+            data = proc.stdout.read(size)
+            if data:
+                yield AudioSegment(data=data, sample_width=width, frame_rate=rate, channels=channels)
+            if len(data) < size:
+                break
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+def analyze_audio_stream(path, start_s=0, end_s=0, sample_rate=None, with_loudness=False, cancel_event=None):
+    # Pierwszy przebieg trybu strumieniowego: szczyt i RMS (dBFS) całego zakresu oraz moce bloków 100 ms do LUFS
+    peak = 0
+    square_sum = 0.0
+    sample_count = 0
+    width = 2
+    powers = []
+    rest = None
+    rate = None
+    for window in iter_audio_windows(path, start_s, end_s, sample_rate=sample_rate, cancel_event=cancel_event):
+        width, rate = window.sample_width, window.frame_rate
+        peak = max(peak, window.max)
+        n = len(window.raw_data) // width
+        square_sum += float(window.rms) ** 2 * n
+        sample_count += n
+        if with_loudness and NUMPY_AVAILABLE:
+            samples = segment_samples(window)
+            if rest is not None:
+                samples = np.concatenate([rest, samples])
+            step = max(1, int(rate * 0.1))
+            used = len(samples) // step * step
+            powers.append(loudness_block_powers(samples[:used], rate))
+            rest = samples[used:]
+    if cancel_event is not None and cancel_event.is_set():
+        # Pomiar części pliku nie może trafić do pamięci podręcznej pod kluczem całego zakresu
+        raise InterruptedError("Analiza przerwana")
+    max_amp = float(1 << (8 * width - 1))
+    to_db = lambda v: 20 * math.log10(v / max_amp) if v > 0 else -float("inf")
+    rms = math.sqrt(square_sum / sample_count) if sample_count else 0
+    lufs = gated_loudness(np.concatenate(powers)) if powers else None
+    return lufs, to_db(peak), to_db(rms)
+
+class SilenceStripper:
+    # Skracanie ciszy w strumieniu jak split_on_silence + sklejenie: przerwa ≥ min_len zostaje skrócona
+    # do keep ms z każdej strony; stan bieżącej przerwy przechodzi przez granice okien
+    def __init__(self, thresh_dbfs, min_len=400, keep=50, step=STREAM_SILENCE_STEP_MS):
+        self.thresh_dbfs = thresh_dbfs
+        self.min_slices = max(1, min_len // step)
+        self.keep_slices = max(1, keep // step)
+        self.step = step
+        self.limit = None
+        self.slice_bytes = None
+        self.rest = b""
+        self.run = []
+        self.long_run = False
+        self.started = False
+        self.removed = 0
+
+    def feed(self, segment):
+        if self.slice_bytes is None:
+            self.slice_bytes = max(1, segment.frame_rate * self.step // 1000) * segment.frame_width
+            self.limit = segment.max_possible_amplitude * 10 ** (self.thresh_dbfs / 20.0)
+        data = self.rest + segment.raw_data
+        used = len(data) // self.slice_bytes * self.slice_bytes
+        self.rest = data[used:]
+        out = []
+        for pos in range(0, used, self.slice_bytes):
+            self._slice(data[pos:pos + self.slice_bytes], segment.sample_width, out)
+        return segment._spawn(b"".join(out))
+
+    def _slice(self, chunk, width, out):
+        if audioop.rms(chunk, width) <= self.limit:
+            self.run.append(chunk)
+            if self.long_run:
+                del self.run[0]
+            elif len(self.run) >= self.min_slices:
+                # Przerwa jest już wystarczająco długa: początek zostaje, ze środka trzymamy tylko ostatnie keep ms
+                if self.started:
+                    out.extend(self.run[:self.keep_slices])
+                self.run = self.run[-self.keep_slices:]
+                self.long_run = True
+            return
+        if self.run:
+            out.extend(self.run)
+            if self.long_run:
+                self.removed += 1
+        self.run = []
+        self.long_run = False
+        self.started = True
+        out.append(chunk)
+
+    def flush(self, segment):
+        out = []
+        if self.rest:
+            self._slice(self.rest, segment.sample_width, out)
+            self.rest = b""
+        if self.run and (not self.long_run or not self.started):
+            out.extend(self.run)
+        elif self.long_run:
+            self.removed += 1
+        self.run = []
+        return segment._spawn(b"".join(out))
+
+class StreamSpeedup:
+    # speedup() z pydub dla kolejnych okien: okno to wielokrotność kawałka (+1 ms, żeby ostatni kawałek
+    # też został przycięty), a sąsiednie okna łączy ten sam crossfade co kawałki wewnątrz pliku
+    def __init__(self, speed, chunk_size=150, crossfade=25):
+        if speed < 1.0:
+            raise ValueError("Tryb strumieniowy obsługuje tylko przyspieszenie (≥ 1.0)")
+        self.speed = speed
+        atk = 1.0 / speed
+        if speed < 2.0:
+            remove = int(chunk_size * (1 - atk) / atk)
+        else:
+            remove = int(chunk_size)
+            chunk_size = int(atk * chunk_size / (1 - atk))
+        self.period = chunk_size + remove
+        self.crossfade = min(crossfade, remove - 1)
+        self.pending = None
+        self.tail = None
+
+    def feed(self, segment):
+        self.pending = segment if self.pending is None else self.pending + segment
+        if len(self.pending) < STREAM_WINDOW_MS:
+            return segment._spawn(b"")
+        cut = (len(self.pending) - 1) // self.period * self.period
+        out = self.pending[:cut + 1].speedup(playback_speed=self.speed)[:-1]
+        self.pending = self.pending[cut:]
+        return self._join(out, final=False)
+
+    def flush(self, segment):
+        if self.pending is None:
+            return segment._spawn(b"")
+        if len(self.pending) > self.period:
+            out = self._join(self.pending.speedup(playback_speed=self.speed), final=True)
+        elif self.tail is not None:
+            out = self.tail + self.pending
+        else:
+            out = self.pending
+        self.pending = self.tail = None
+        return out
+
+    def _join(self, out, final):
+        if self.tail is not None and self.crossfade > 0:
+            out = self.tail.append(out, crossfade=self.crossfade)
+        elif self.tail is not None:
+            out = self.tail + out
+        if final or self.crossfade <= 0:
+            self.tail = None
+            return out
+        self.tail = out[-self.crossfade:]
+        return out[:-self.crossfade]
+
+class StreamResampler:
+    # Zmiana tonu jak w trybie zwykłym (odtworzenie z częstotliwością * ton i powrót do oryginalnej),
+    # z zachowaniem stanu resamplera między oknami – bez trzasków na granicach
+    def __init__(self, pitch):
+        self.pitch = pitch
+        self.state = None
+
+    def feed(self, segment):
+        if len(segment.raw_data) == 0:
+            return segment
+        data, self.state = audioop.ratecv(segment.raw_data, segment.sample_width, segment.channels,
+                                          int(segment.frame_rate * self.pitch), segment.frame_rate, self.state)
+        return segment._spawn(data)
+
+def _stream_audio_file(path, outdir, speed, pitch, gain, silence_remove, fmt, start_s, end_s, log, cancel_event,
+                       codec_settings=None, loudness=None):
+    # Tryb strumieniowy: dekodowanie tylko zakresu start–koniec, obróbka w oknach STREAM_WINDOW_MS
+    # i zapis na bieżąco przez StreamEncoder – zużycie pamięci nie zależy od długości nagrania
+    sample_rate = codec_settings_for(fmt, codec_settings).get("sample_rate")
+    if start_s > 0 or end_s > 0:
+        log(f"Przycinam: {int(start_s*1000)}ms - " + (f"{int(end_s*1000)}ms" if end_s > 0 else "koniec"))
+    change = 0.0
+    thresh = None
+    if silence_remove or loudness is not None:
+        stat = os.stat(path)
+        analyze = lambda: list(analyze_audio_stream(path, start_s, end_s, sample_rate, loudness is not None, cancel_event))
+        try:
+            if loudness is not None:
+                key = f"stream:{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}:{start_s}:{end_s}"
+                measured, peak, rms = get_loudness_cache().lookup(key, analyze)
+            else:
+                measured, peak, rms = analyze()
+        except InterruptedError:
+            return
+        if silence_remove:
+            # Próg liczony jak w trybie zwykłym (dBFS całości - 24) – normalizacja przesuwa oba poziomy tak samo
+            thresh = rms - 24
+            if loudness is None and peak > -float("inf"):
+                change += -0.1 - peak
+        if loudness is not None and measured is not None:
+            # Głośność mierzona na wejściu: bramkowanie BS.1770 pomija ciszę, a tempo/ton prawie jej nie zmieniają
+            level = loudness - measured
+            if level > LOUDNESS_PEAK_CEILING - peak:
+                level = LOUDNESS_PEAK_CEILING - peak
+            log(f"Głośność: {measured:.1f} LUFS → {measured + level:.1f} LUFS (zmiana {level:+.1f} dB)")
+            change += level
+        elif loudness is not None and not NUMPY_AVAILABLE:
+            log("Moduł numpy nie zainstalowany – pomijam normalizację głośności! pip install numpy")
+    if loudness is None and gain != 1.0:
+        change += 20 * (gain - 1)
+    stripper = SilenceStripper(thresh) if silence_remove else None
+    speeder = StreamSpeedup(speed) if speed != 1.0 else None
+    resampler = StreamResampler(pitch) if pitch != 1.0 else None
+    output_filename, _ = get_sequential_filename(outdir, "output2", fmt)
+    encoder = StreamEncoder(output_filename, fmt, codec_settings)
+
+    def write(segment):
+        if resampler:
+            segment = resampler.feed(segment)
+        if len(segment.raw_data) == 0:
+            return
+        if change:
+            segment = segment.apply_gain(change)
+        encoder.write(segment)
+
+    last = None
+    try:
+        for window in iter_audio_windows(path, start_s, end_s, sample_rate=sample_rate, cancel_event=cancel_event):
+            last = window
+            if stripper:
+                window = stripper.feed(window)
+            if speeder:
+                window = speeder.feed(window)
+            write(window)
+        if last is not None and not (cancel_event is not None and cancel_event.is_set()):
+            tail = stripper.flush(last) if stripper else last._spawn(b"")
+            if speeder:
+                write(speeder.feed(tail) if len(tail.raw_data) else tail)
+                tail = speeder.flush(last)
+            write(tail)
+    finally:
+        saved = encoder.close()
+    if cancel_event is not None and cancel_event.is_set():
+        if os.path.exists(output_filename):
+            os.remove(output_filename)
+        return
+    if stripper and stripper.removed:
+        log(f"Usunięto ciszę ({stripper.removed} przerw)")
+    if saved:
+        log(f"✔️ Zapisano: {output_filename}")
+    else:
+        if os.path.exists(output_filename):
+            os.remove(output_filename)
+        log(f"⚠️ Pusty zakres – pominięto: {os.path.basename(path)}")
+
 def ffmpeg_available():
     try:
         subprocess.run(["ffmpeg", "-version"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -371,6 +1453,825 @@ def load_settings(path):
             return {}
     return {}
 
+class JobScheduler:
+    # Kolejka zadań TTS/batch: priorytety, limit równoległości na silnik,
+    # osobny token anulowania dla każdego zadania i zapis kolejki do pliku JSON.
+    def __init__(self, workers=CPU_THREADS, queue_path=DEFAULT_QUEUE_FILE, limits=None):
+        self.queue_path = queue_path
+        self.limits = dict(ENGINE_CONCURRENCY if limits is None else limits)
+        self.cond = threading.Condition()
+        self.pending = []
+        self.running = {}
+        self.jobs = {}
+        self.counter = itertools.count(1)
+        for _ in range(max(1, workers)):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def submit(self, kind, task, log, done=None, priority=0):
+        with self.cond:
+            job_id = next(self.counter)
+            while job_id in self.jobs:
+                job_id = next(self.counter)
+            job = {
+                "id": job_id,
+                "kind": kind,
+                "task": task,
+                "priority": int(priority),
+                "engine": task.get("engine", "") if kind == "tts" else "batch",
+                "status": "pending",
+                "cancel": threading.Event(),
+                "log": log,
+                "done": done,
+            }
+            self.jobs[job_id] = job
+            heapq.heappush(self.pending, (-job["priority"], job_id))
+            self._save()
+            self.cond.notify_all()
+        log_event(f"Zadanie #{job_id} ({kind}) dodane do kolejki, priorytet {job['priority']}")
+        return job_id
+
+    def cancel(self, job_id):
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if not job:
+                return False
+            job["cancel"].set()
+            if job["status"] == "pending":
+                job["status"] = "cancelled"
+                self.pending = [p for p in self.pending if p[1] != job_id]
+                heapq.heapify(self.pending)
+                del self.jobs[job_id]
+                self._save()
+            return True
+
+    def cancel_all(self, kind=None):
+        with self.cond:
+            ids = [j["id"] for j in self.jobs.values() if kind is None or j["kind"] == kind]
+        for job_id in ids:
+            self.cancel(job_id)
+        return len(ids)
+
+    def cancel_running(self, kind=None):
+        # Zatrzymuje tylko trwające zadania – oczekujące w kolejce zostają
+        with self.cond:
+            ids = [j["id"] for j in self.jobs.values()
+                   if j["status"] == "running" and (kind is None or j["kind"] == kind)]
+        for job_id in ids:
+            self.cancel(job_id)
+        return len(ids)
+
+    def list_jobs(self):
+        # Migawka do listy zadań w GUI: najpierw trwające, potem kolejka w kolejności priorytetów
+        with self.cond:
+            jobs = sorted(self.jobs.values(), key=lambda j: (j["status"] != "running", -j["priority"], j["id"]))
+            return [{
+                "id": j["id"],
+                "kind": j["kind"],
+                "engine": j["engine"],
+                "priority": j["priority"],
+                "status": "stopping" if j["cancel"].is_set() else j["status"],
+                "name": (os.path.basename(j["task"].get("file", "")) if j["kind"] == "tts"
+                         else f"{len(j['task'].get('files', []))} plików"),
+            } for j in jobs]
+
+    def _next_job(self):
+        # Najwyższy priorytet, którego silnik ma wolny slot; reszta czeka w kolejce
+        for entry in sorted(self.pending):
+            job = self.jobs[entry[1]]
+            if self.running.get(job["engine"], 0) < self.limits.get(job["engine"], 1):
+                self.pending.remove(entry)
+                heapq.heapify(self.pending)
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                job = self._next_job()
+                while job is None:
+                    self.cond.wait()
+                    job = self._next_job()
+                job["status"] = "running"
+                self.running[job["engine"]] = self.running.get(job["engine"], 0) + 1
+                self._save()
+            try:
+                self._run(job)
+            except Exception as e:
+                job["log"](f"Błąd zadania #{job['id']}: {e}")
+                log_event(f"Błąd zadania #{job['id']}: {e}")
+            finally:
+                with self.cond:
+                    self.running[job["engine"]] -= 1
+                    self.jobs.pop(job["id"], None)
+                    self._save()
+                    self.cond.notify_all()
+
+    def _run(self, job):
+        task, log = job["task"], job["log"]
+        log_event(f"Start zadania #{job['id']} ({job['kind']})")
+        if job["kind"] == "tts":
+            generate_audio_task(task, log, job["done"], cancel_event=job["cancel"])
+        else:
+            batch_audio_task(log=log, cancel_event=job["cancel"], **task)
+        log_event(f"Koniec zadania #{job['id']} ({job['kind']})")
+
+    def _save(self):
+        if not self.queue_path:
+            return
+        queued = [
+            {"kind": j["kind"], "task": {k: v for k, v in j["task"].items() if k not in QUEUE_SECRET_KEYS},
+             "priority": j["priority"]}
+            for j in sorted(self.jobs.values(), key=lambda j: (-j["priority"], j["id"]))
+        ]
+        # Zapis do pliku tymczasowego i podmiana – przerwany zapis nie zgubi całej kolejki
+        tmp = f"{self.queue_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(queued, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.queue_path)
+        except Exception as e:
+            log_event(f"Błąd zapisu kolejki: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def restore(self, callbacks, secrets=None):
+        # callbacks: {"tts": (log, done), "batch": (log, done)} – zadania przerwane zamknięciem programu;
+        # secrets: profil ustawień, z którego wracają klucze API pominięte w pliku kolejki
+        saved = load_settings(self.queue_path) if self.queue_path else []
+        restored = 0
+        for item in saved if isinstance(saved, list) else []:
+            kind = item.get("kind")
+            if kind not in callbacks or not isinstance(item.get("task"), dict):
+                continue
+            task = item["task"]
+            if kind == "tts":
+                for key in QUEUE_SECRET_KEYS:
+                    if not task.get(key) and (secrets or {}).get(key):
+                        task[key] = secrets[key]
+            log, done = callbacks[kind]
+            self.submit(kind, task, log, done, item.get("priority", 0))
+            restored += 1
+        if restored:
+            log_event(f"Przywrócono {restored} zadań z kolejki: {self.queue_path}")
+        return restored
+
+WATCH_EXTENSIONS = (".txt", ".csv", ".srt")
+WATCH_STATE_FILE = ".speakvault_watch.json"
+WATCH_SYNTH_KEYS = ("engine", "voice_id", "eleven_voice_id", "coqui_speaker", "tempo", "pitch", "gain",
+                    "loudness_normalize", "loudness_target")
+
+def iter_files(folder, extensions, skip=None):
+    # Rekurencyjny os.scandir (bez rekurencji w Pythonie) – stat z DirEntry jest tani,
+    # więc przejście przez tysiące plików kosztuje niewiele
+    stack = [folder]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not skip or os.path.abspath(entry.path) != skip:
+                                stack.append(entry.path)
+                        elif entry.name.lower().endswith(extensions):
+                            yield entry
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+def scan_text_files(folder, skip=None):
+    found = {}
+    for entry in iter_files(folder, WATCH_EXTENSIONS, skip):
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        found[entry.path] = [st.st_mtime_ns, st.st_size]
+    return found
+
+def audio_metadata(path):
+    # Lekkie metadane do listy batch: format z rozszerzenia, długość z nagłówka WAV lub z ffprobe
+    fmt = os.path.splitext(path)[1][1:].lower()
+    duration = None
+    try:
+        if fmt == "wav":
+            with wave.open(path, "rb") as w:
+                duration = w.getnframes() / float(w.getframerate())
+        else:
+            duration = float(mediainfo(path).get("duration") or 0) or None
+    except Exception:
+        pass
+    return fmt, duration
+
+class FolderWatcher:
+    # Tryb bez GUI: obserwuje skrypty TXT/CSV/SRT i generuje audio tylko dla nowych/zmienionych linii.
+    # Każda linia ma plik w folderze "<nazwa>_parts" nazwany skrótem tekstu i parametrów syntezy,
+    # więc niezmienione linie (także po restarcie) nie są syntezowane ponownie.
+    def __init__(self, folder, out_dir, task, log, interval=2.0):
+        self.folder = folder
+        self.out_dir = out_dir
+        self.task = task
+        self.log = log
+        self.interval = interval
+        self.state_path = os.path.join(out_dir, WATCH_STATE_FILE)
+        state = load_settings(self.state_path)
+        self.done = state if isinstance(state, dict) else {}
+        self.seen = {}
+        self.keys = {}
+
+    def line_key(self, text):
+        fmt = self.parts_format()
+        params = json.dumps([self.task.get(k) for k in WATCH_SYNTH_KEYS] + [fmt, codec_settings_for(fmt, self.task.get("codec_settings"))],
+                            ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1((normalize_chunk(text) + "\0" + params).encode("utf-8")).hexdigest()[:16]
+
+    def settings_key(self):
+        # Skrót ustawień wpływających na wynik – zmiana głosu, silnika czy kodeka w profilu
+        # unieważnia zapisany stan także dla skryptów, które się nie zmieniły
+        params = [self.task.get(k) for k in WATCH_SYNTH_KEYS + ("format", "merge", "codec_settings")]
+        return hashlib.sha1(json.dumps(params, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+    def parts_format(self):
+        # Przy scalaniu części trzymamy w WAV – szybki odczyt i brak podwójnej kompresji
+        return "wav" if self.task.get("merge") else self.task.get("format", DEFAULT_FORMAT)
+
+    def output_name(self, path):
+        rel = os.path.splitext(os.path.relpath(path, self.folder))[0]
+        return rel.replace(os.sep, "__").replace("/", "__")
+
+    def poll(self, cancel_event):
+        current = scan_text_files(self.folder, os.path.abspath(self.out_dir))
+        settings = self.settings_key()
+        # Plik przetwarzamy dopiero, gdy jego stat nie zmienił się przez jeden cykl (zapis w edytorze zakończony)
+        ready = [p for p, st in current.items()
+                 if self.seen.get(p) == st and self.done.get(p) != {"stat": st, "settings": settings}]
+        self.seen = current
+        for path in sorted(ready):
+            if cancel_event.is_set():
+                break
+            try:
+                # Plik jest gotowy dopiero, gdy istnieją wszystkie części – inaczej ponowimy przy następnym cyklu
+                if self.regenerate(path, cancel_event):
+                    self.done[path] = {"stat": current[path], "settings": settings}
+                else:
+                    self.done.pop(path, None)
+            except Exception as e:
+                self.log(f"❌ Błąd obserwacji {path}: {e}")
+                log_event(f"Błąd obserwacji {path}: {e}")
+        removed = [p for p in self.done if p not in current]
+        for path in removed:
+            del self.done[path]
+            self.keys.pop(path, None)
+        if ready or removed:
+            save_settings(self.done, self.state_path)
+
+    def regenerate(self, path, cancel_event):
+        fmt = self.parts_format()
+        name = self.output_name(path)
+        parts_dir = os.path.join(self.out_dir, name + "_parts")
+        os.makedirs(parts_dir, exist_ok=True)
+        entries = parse_file(path)
+        texts = [e[2] if len(e) == 5 else e[1] for e in entries]
+        keys = [self.line_key(t) for t in texts]
+        part_files = {}
+        for key, text in zip(keys, texts):
+            part_files[key] = [os.path.join(parts_dir, f"{key}_{n+1}.{fmt}") for n in range(len(split_text(text, CHAR_LIMIT)))]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in missing and not all(os.path.exists(f) for f in part_files[key]):
+                missing[key] = text
+        previous = self.keys.get(path)
+        if previous is not None:
+            self.log(f"🔁 {os.path.basename(path)}: +{len(set(keys) - set(previous))} / -{len(set(previous) - set(keys))} linii, do syntezy: {len(missing)}")
+        else:
+            self.log(f"🔁 {os.path.basename(path)}: {len(keys)} linii, do syntezy: {len(missing)}")
+        if missing:
+            task = dict(self.task)
+            task.update({
+                "file": path,
+                "lines": list(missing.items()),
+                "start_line": 1,
+                "end_line": 0,
+                "format": fmt,
+                "merge": False,
+                "output_dir": parts_dir,
+                "name_by_label": True,
+                "eleven_passthrough": task.get("eleven_passthrough", True) and fmt == task.get("format"),
+            })
+            generate_audio_task(task, self.log, cancel_event=cancel_event)
+        self.keys[path] = keys
+        if cancel_event.is_set():
+            return False
+        failed = [key for key in dict.fromkeys(keys) if not all(os.path.exists(f) for f in part_files[key])]
+        if failed:
+            self.log(f"⚠️ {os.path.basename(path)}: {len(failed)} linii bez audio – scalam resztę, ponowię przy następnym sprawdzeniu")
+            log_event(f"Obserwacja folderu – brak audio dla {len(failed)} linii: {path}")
+        self.restitch(name, parts_dir, keys, part_files)
+        wanted = {os.path.basename(f) for files in part_files.values() for f in files}
+        for f in os.listdir(parts_dir):
+            if f not in wanted and not f.startswith("_tmp_"):
+                os.remove(os.path.join(parts_dir, f))
+        return not failed
+
+    def restitch(self, name, parts_dir, keys, part_files):
+        fmt = self.task.get("format", DEFAULT_FORMAT)
+        ordered = [f for key in keys for f in part_files[key] if os.path.exists(f)]
+        if not self.task.get("merge"):
+            # Bez scalania wynikiem są pliki części; playlista zachowuje kolejność linii
+            playlist = os.path.join(self.out_dir, name + ".m3u")
+            with open(playlist, "w", encoding="utf-8") as f:
+                for fn in ordered:
+                    f.write(os.path.relpath(fn, self.out_dir) + "\n")
+            self.log(f"✔️ Zaktualizowano: {os.path.basename(playlist)}")
+            return
+        output_filename = os.path.join(self.out_dir, f"{name}.{fmt}")
+        tmp = os.path.join(self.out_dir, f"_tmp_{name}.{fmt}")
+        codec_settings = self.task.get("codec_settings")
+        if self.task.get("loudness_normalize"):
+            merged = NormalizedMerge(tmp, fmt, codec_settings, float(self.task.get("loudness_target", DEFAULT_LOUDNESS_TARGET)))
+        else:
+            merged = StreamEncoder(tmp, fmt, codec_settings)
+        for fn in ordered:
+            merged.write(AudioSegment.from_file(fn))
+        if merged.close():
+            os.replace(tmp, output_filename)
+            self.log(f"✔️ Zaktualizowano scalone: {os.path.basename(output_filename)}")
+            log_event(f"Obserwacja folderu – zaktualizowano: {os.path.basename(output_filename)}")
+
+    def run(self, cancel_event):
+        self.log(f"👀 Obserwuję folder: {self.folder} (co {self.interval}s)")
+        while not cancel_event.is_set():
+            self.poll(cancel_event)
+            cancel_event.wait(self.interval)
+
+def run_watch(folder, out_dir=None, settings_path=DEFAULT_SETTINGS_FILE, interval=2.0):
+    settings = load_settings(settings_path)
+    task = dict(settings)
+    out_dir = out_dir or settings.get("output_dir") or "audio_output"
+    os.makedirs(out_dir, exist_ok=True)
+    task.setdefault("engine", "Google TTS")
+    task.setdefault("format", DEFAULT_FORMAT)
+    task.setdefault("merge", False)
+
+    def log(msg):
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}", flush=True)
+
+    cancel_event = threading.Event()
+    try:
+        FolderWatcher(folder, out_dir, task, log, interval).run(cancel_event)
+    except KeyboardInterrupt:
+        cancel_event.set()
+        log("Zatrzymano obserwację folderu.")
+
+DEFAULT_SERVER_HOST = "127.0.0.1"
+DEFAULT_SERVER_PORT = 8765
+SERVER_CACHE_DIR = "speakvault_cache"
+SERVER_MAX_PENDING = 64  # żądania ponad ten limit dostają 503 zamiast czekać w nieskończoność
+SERVER_STREAM_CHUNK = 64 * 1024
+SERVER_SYNTH_KEYS = ("engine", "format", "voice_id", "eleven_voice_id", "coqui_speaker", "tempo", "pitch", "gain",
+                     "loudness_normalize", "loudness_target", "codec_settings")
+AUDIO_MIME_TYPES = {"ogg": "audio/ogg", "mp3": "audio/mpeg", "wav": "audio/wav"}
+SERVER_CACHE_LIMIT_MB = 512  # pamięć podręczna serwera: najstarsze pliki usuwane ponad ten rozmiar...
+SERVER_CACHE_MAX_DAYS = 30   # ...albo gdy nie były używane przez tyle dni
+SERVER_CACHE_TRIM_INTERVAL = 60.0
+
+def check_request_codec_settings(value):
+    # codec_settings z żądania HTTP: {format: {opcja: wartość prosta}} tylko dla znanych formatów i opcji
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise ValueError("codec_settings musi być obiektem JSON")
+    for fmt, options in value.items():
+        if fmt not in SUPPORTED_FORMATS or not isinstance(options, dict):
+            raise ValueError(f"Nieprawidłowe codec_settings dla formatu: {fmt}")
+        for name, option in options.items():
+            if name not in DEFAULT_CODEC_SETTINGS[fmt] or isinstance(option, bool) or not isinstance(option, (str, int, float)):
+                raise ValueError(f"Nieprawidłowa opcja codec_settings: {fmt}.{name}")
+    return value
+
+class SynthesisService:
+    # Synteza dla serwera HTTP: wspólna pamięć podręczna plików, łączenie identycznych równoczesnych
+    # żądań w jedną syntezę i limit równoległości na silnik (ENGINE_CONCURRENCY)
+    def __init__(self, defaults=None, cache_dir=SERVER_CACHE_DIR, batch_root=None, log=log_event):
+        self.defaults = dict(defaults or {})
+        self.cache_dir = cache_dir
+        self.log = log
+        os.makedirs(cache_dir, exist_ok=True)
+        # /batch czyta i zapisuje pliki tylko w tym folderze; bez niego obróbka batch przez HTTP jest wyłączona
+        self.batch_root = os.path.realpath(batch_root) if batch_root else None
+        self.cache_limit = float(self.defaults.get("server_cache_mb", SERVER_CACHE_LIMIT_MB)) * 1024 * 1024
+        self.cache_max_age = float(self.defaults.get("server_cache_days", SERVER_CACHE_MAX_DAYS)) * 86400
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.last_trim = 0.0
+        self.stats = {"requests": 0, "cache_hits": 0, "coalesced": 0, "synthesized": 0, "cache_evicted": 0}
+        self.trim_cache()
+
+    def make_task(self, params):
+        task = dict(self.defaults)
+        task.update(params)
+        task.setdefault("engine", "Google TTS")
+        task.setdefault("format", DEFAULT_FORMAT)
+        if task["format"] not in SUPPORTED_FORMATS:
+            raise ValueError(f"Nieobsługiwany format: {task['format']}")
+        if "codec_settings" in params:
+            check_request_codec_settings(params["codec_settings"])
+        return task
+
+    def synthesize(self, params, log=None):
+        log = log or self.log
+        task = self.make_task(params)
+        text = " ".join(str(params.get("text", "")).split())
+        if not text:
+            raise ValueError("Brak tekstu do syntezy")
+        key = hashlib.sha1(json.dumps([normalize_chunk(text)] + [task.get(k) for k in SERVER_SYNTH_KEYS],
+                                      ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+        path = os.path.join(self.cache_dir, f"{key}.{task['format']}")
+        with self.lock:
+            self.stats["requests"] += 1
+            if os.path.exists(path):
+                self.stats["cache_hits"] += 1
+                try:
+                    # Czas modyfikacji = ostatnie użycie, więc czyszczenie usuwa najdawniej używane pliki
+                    os.utime(path)
+                except OSError:
+                    pass
+                return path
+            waiter = self.inflight.get(key)
+            if waiter is None:
+                self.inflight[key] = waiter = {"done": threading.Event(), "error": None}
+                owner = True
+            else:
+                self.stats["coalesced"] += 1
+                owner = False
+        if not owner:
+            waiter["done"].wait()
+            if waiter["error"]:
+                raise RuntimeError(waiter["error"])
+            return path
+        try:
+            with get_engine_slot(task["engine"]):
+                self._render(task, text, key, path, log)
+            with self.lock:
+                self.stats["synthesized"] += 1
+            if time.time() - self.last_trim >= SERVER_CACHE_TRIM_INTERVAL:
+                self.trim_cache()
+            return path
+        except Exception as e:
+            waiter["error"] = str(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+            waiter["done"].set()
+
+    def trim_cache(self):
+        # Najpierw pliki starsze niż limit wieku, potem najdawniej używane, aż rozmiar zmieści się w limicie
+        self.last_trim = time.time()
+        files = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.is_file() and not entry.name.startswith("_tmp_"):
+                        st = entry.stat()
+                        files.append((st.st_mtime, st.st_size, entry.path))
+        except OSError as e:
+            self.log(f"Błąd odczytu pamięci podręcznej serwera: {e}")
+            return 0
+        files.sort()
+        total = sum(f[1] for f in files)
+        removed = 0
+        for mtime, size, path in files:
+            if total <= self.cache_limit and self.last_trim - mtime <= self.cache_max_age:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        if removed:
+            with self.lock:
+                self.stats["cache_evicted"] += removed
+            self.log(f"Pamięć podręczna serwera: usunięto {removed} plików")
+        return removed
+
+    def batch_path(self, path):
+        if self.batch_root is None:
+            raise PermissionError("Obróbka batch przez HTTP jest wyłączona – uruchom serwer z --batch-root")
+        real = os.path.realpath(path)
+        if os.path.commonpath([real, self.batch_root]) != self.batch_root:
+            raise PermissionError(f"Ścieżka poza folderem batch serwera: {path}")
+        return real
+
+    def _render(self, task, text, key, path, log):
+        fmt = task["format"]
+        tmp_files = []
+        try:
+            segments = []
+            for n, chunk in enumerate(split_text(text, CHAR_LIMIT)):
+                tmp = os.path.join(self.cache_dir, f"_tmp_{key}_{n}.{fmt}")
+                tmp_files.append(tmp)
+                if not synthesize_fragment(task, chunk, tmp, log):
+                    raise RuntimeError(f"Nie udało się wygenerować fragmentu: {chunk[:40]}")
+                segments.append(AudioSegment.from_file(tmp))
+            audio = segments[0]
+            for seg in segments[1:]:
+                audio += seg
+            loudness_target = float(task.get("loudness_target", DEFAULT_LOUDNESS_TARGET)) if task.get("loudness_normalize") else None
+            audio = apply_voice_effects(audio, float(task.get("tempo", 1.0)), float(task.get("pitch", 1.0)),
+                                        float(task.get("gain", 1.0)), loudness_target)
+            partial = os.path.join(self.cache_dir, f"_tmp_{key}.{fmt}")
+            export_audio(audio, partial, fmt, task.get("codec_settings"))
+            os.replace(partial, path)
+        finally:
+            for tmp in tmp_files:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+class SpeakVaultRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    service = None
+    admission = None
+
+    def log_message(self, format, *args):
+        self.service.log(f"HTTP {self.address_string()} " + format % args)
+
+    def send_json(self, code, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if code == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        data = json.loads(self.rfile.read(length).decode("utf-8") or "{}") if length else {}
+        if not isinstance(data, dict):
+            raise ValueError("Oczekiwano obiektu JSON")
+        return data
+
+    def do_GET(self):
+        if self.path == "/health":
+            self.send_json(200, {"status": "ok", "engines": list(ENGINE_CONCURRENCY), "stats": self.service.stats})
+        else:
+            self.send_json(404, {"error": "Nie znaleziono"})
+
+    def do_POST(self):
+        if self.path not in ("/synthesize", "/batch"):
+            self.send_json(404, {"error": "Nie znaleziono"})
+            return
+        # Tylko application/json: przeglądarka nie wyśle takiego żądania z obcej strony bez zapytania
+        # wstępnego (CORS), na które serwer nie odpowiada – strony www nie mogą sterować syntezą
+        content_type = (self.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+        if content_type != "application/json":
+            self.send_json(415, {"error": "Wymagany nagłówek Content-Type: application/json"})
+            return
+        if not self.admission.acquire(blocking=False):
+            self.send_json(503, {"error": "Serwer zajęty, spróbuj ponownie"})
+            return
+        try:
+            params = self.read_json()
+            if self.path == "/synthesize":
+                self.handle_synthesize(params)
+            else:
+                self.handle_batch(params)
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": str(e)})
+        except PermissionError as e:
+            self.send_json(403, {"error": str(e)})
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            self.service.log(f"Błąd serwera ({self.command} {self.path}): {e}\n{traceback.format_exc().rstrip()}")
+            self.send_json(500, {"error": str(e)})
+        finally:
+            self.admission.release()
+
+    def handle_synthesize(self, params):
+        path = self.service.synthesize(params)
+        fmt = os.path.splitext(path)[1][1:]
+        self.send_response(200)
+        self.send_header("Content-Type", AUDIO_MIME_TYPES.get(fmt, "application/octet-stream"))
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.end_headers()
+        # Blokujący zapis do gniazda = naturalny backpressure: wolny klient spowalnia odczyt, pamięć stała
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(SERVER_STREAM_CHUNK)
+                if not block:
+                    break
+                self.wfile.write(block)
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def handle_batch(self, params):
+        # Log zadania batch strumieniowany linia po linii; ograniczona kolejka wstrzymuje batch, gdy klient nie nadąża
+        # Format trafia do nazwy pliku i do ffmpeg – sprawdzany przed zbudowaniem jakiejkolwiek ścieżki
+        fmt = params.get("fmt", DEFAULT_FORMAT)
+        if fmt not in SUPPORTED_FORMATS:
+            raise ValueError(f"Nieobsługiwany format: {fmt}")
+        if not isinstance(params.get("files"), list):
+            raise ValueError("files musi być listą ścieżek")
+        if "codec_settings" in params:
+            check_request_codec_settings(params["codec_settings"])
+        kwargs = {
+            "files": [self.service.batch_path(f) for f in params["files"]],
+            "outdir": self.service.batch_path(params["outdir"]),
+            "speed": float(params.get("speed", 1.0)),
+            "pitch": float(params.get("pitch", 1.0)),
+            "gain": float(params.get("gain", 1.0)),
+            "silence_remove": bool(params.get("silence_remove", False)),
+            "fmt": fmt,
+            "start_s": float(params.get("start_s", 0)),
+            "end_s": float(params.get("end_s", 0)),
+            "codec_settings": params.get("codec_settings", self.service.defaults.get("codec_settings")),
+            "loudness_normalize": bool(params.get("loudness_normalize", False)),
+            "loudness_target": float(params.get("loudness_target", DEFAULT_LOUDNESS_TARGET)),
+            "streaming": bool(params.get("streaming", False)),
+        }
+        if not os.path.isdir(kwargs["outdir"]):
+            raise ValueError(f"Folder wyjściowy nie istnieje: {kwargs['outdir']}")
+        lines = queue.Queue(maxsize=100)
+        cancel = threading.Event()
+
+        def run():
+            try:
+                with get_engine_slot("batch"):
+                    batch_audio_task(log=lambda msg: lines.put(msg), cancel_event=cancel, **kwargs)
+            except Exception as e:
+                lines.put(f"❌ Błąd: {e}")
+            finally:
+                lines.put(None)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        threading.Thread(target=run, daemon=True).start()
+        try:
+            while True:
+                msg = lines.get()
+                if msg is None:
+                    break
+                self.write_chunk((msg + "\n").encode("utf-8"))
+            self.write_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            cancel.set()
+            while lines.get() is not None:
+                pass
+
+def run_server(host=DEFAULT_SERVER_HOST, port=DEFAULT_SERVER_PORT, settings_path=DEFAULT_SETTINGS_FILE, cache_dir=SERVER_CACHE_DIR,
+               batch_root=None):
+    settings = load_settings(settings_path)
+
+    def log(msg):
+        # Serwer działa bez GUI: log na stderr z czasem, jak w trybie obserwacji folderu
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}", file=sys.stderr, flush=True)
+
+    handler = type("Handler", (SpeakVaultRequestHandler,), {
+        "service": SynthesisService(settings, cache_dir, batch_root or settings.get("server_batch_root"), log),
+        "admission": threading.BoundedSemaphore(SERVER_MAX_PENDING),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print(f"SpeakVault: serwer syntezy na http://{host}:{port} (POST /synthesize, POST /batch, GET /health)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+class VirtualFileList:
+    # Lista plików batch, która trzyma w Listbox tylko widoczne wiersze – przewijanie i dodawanie
+    # dziesiątek tysięcy pozycji nie blokuje GUI. Metadane ładowane w tle dla widocznych wierszy.
+    def __init__(self, parent, items, height=6, **listbox_opts):
+        self.items = items
+        self.rows = height
+        self.top = 0
+        self.selected = None
+        self.metadata = {}
+        self.pending = set()
+        self.visible = set()
+        self.draining = False
+        self.results = queue.Queue()
+        self.loader = ThreadPoolExecutor(max_workers=2)
+        self.frame = tk.Frame(parent, bg="#181e22")
+        self.listbox = tk.Listbox(self.frame, height=height, selectmode="browse", exportselection=False, **listbox_opts)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient="vertical", command=self.yview)
+        self.listbox.pack(side="left", fill="both", expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+        self.listbox.bind("<<ListboxSelect>>", self.on_select)
+        self.listbox.bind("<MouseWheel>", lambda e: self.scroll(-1 if e.delta > 0 else 1))
+        self.listbox.bind("<Button-4>", lambda e: self.scroll(-1))
+        self.listbox.bind("<Button-5>", lambda e: self.scroll(1))
+        self.listbox.bind("<Up>", lambda e: self.move_selection(-1))
+        self.listbox.bind("<Down>", lambda e: self.move_selection(1))
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def format_row(self, path):
+        meta = self.metadata.get(path)
+        if not meta:
+            return path
+        fmt, duration = meta
+        if duration is None:
+            return f"{path}  [{fmt}]"
+        return f"{path}  [{fmt}, {int(duration // 60)}:{int(duration % 60):02d}]"
+
+    def refresh(self):
+        count = len(self.items)
+        self.top = max(0, min(self.top, count - self.rows))
+        visible = self.items[self.top:self.top + self.rows]
+        self.visible = set(visible)
+        self.listbox.delete(0, "end")
+        for path in visible:
+            self.listbox.insert("end", self.format_row(path))
+        if self.selected is not None and self.top <= self.selected < self.top + len(visible):
+            self.listbox.selection_set(self.selected - self.top)
+        if count:
+            self.scrollbar.set(self.top / count, min(1.0, (self.top + self.rows) / count))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+        self.request_metadata(visible)
+        return "break"
+
+    def yview(self, *args):
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * len(self.items))
+        elif args[0] == "scroll":
+            amount = int(args[1])
+            self.top += amount * self.rows if args[2] == "pages" else amount
+        self.refresh()
+
+    def scroll(self, amount):
+        self.top += amount
+        return self.refresh()
+
+    def on_select(self, event=None):
+        sel = self.listbox.curselection()
+        if sel:
+            self.selected = self.top + sel[0]
+
+    def move_selection(self, step):
+        if not self.items:
+            return "break"
+        current = self.selected if self.selected is not None else self.top - step
+        self.selected = max(0, min(len(self.items) - 1, current + step))
+        if self.selected < self.top:
+            self.top = self.selected
+        elif self.selected >= self.top + self.rows:
+            self.top = self.selected - self.rows + 1
+        return self.refresh()
+
+    def curselection(self):
+        if self.selected is not None and self.selected < len(self.items):
+            return (self.selected,)
+        return ()
+
+    def get(self, index):
+        return self.items[index]
+
+    def request_metadata(self, paths):
+        for path in paths:
+            if path not in self.metadata and path not in self.pending:
+                self.pending.add(path)
+                self.loader.submit(self._load_metadata, path)
+        if self.pending and not self.draining:
+            self.draining = True
+            self.frame.after(100, self._drain_metadata)
+
+    def _load_metadata(self, path):
+        # Wiersz mógł zniknąć z widoku zanim doszło do odczytu – wtedy nic nie robimy
+        meta = audio_metadata(path) if path in self.visible else None
+        self.results.put((path, meta))
+
+    def _drain_metadata(self):
+        self.draining = False
+        changed = False
+        while True:
+            try:
+                path, meta = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending.discard(path)
+            if meta is not None:
+                self.metadata[path] = meta
+                changed = changed or path in self.visible
+        if changed:
+            self.refresh()
+        elif self.pending:
+            self.draining = True
+            self.frame.after(100, self._drain_metadata)
+
 class SpeakVaultApp:
     def __init__(self, root):
         self.root = root
@@ -388,6 +2289,9 @@ class SpeakVaultApp:
         self.settings_path_var = tk.StringVar(value=DEFAULT_SETTINGS_FILE)
         self.settings_name_var = tk.StringVar(value="speakvault_settings.json")
         self.settings = load_settings(self.settings_path_var.get())
+        self.codec_settings = {}
+        self.encode_workers = DEFAULT_ENCODE_WORKERS
+        self.pipeline_settings = {}
 
         self.notebook = ttk.Notebook(root, style="Custom.TNotebook")
         self.notebook.pack(fill="both", expand=True)
@@ -400,15 +2304,25 @@ class SpeakVaultApp:
         self.build_batch_tab(self.batch_frame)
         self.notebook.add(self.batch_frame, text="Narzędzia batch audio")
 
+        self.queue_frame = ttk.Frame(self.notebook)
+        self.build_queue_tab(self.queue_frame)
+        self.notebook.add(self.queue_frame, text="Kolejka zadań")
+
         self.events_frame = ttk.Frame(self.notebook)
         self.build_events_tab(self.events_frame)
         self.notebook.add(self.events_frame, text="Dziennik zdarzeń")
 
         self.last_audio_path = None
-        self.batch_files = []
 
         self.load_settings_to_gui()
 
+        self.scheduler = JobScheduler()
+        self.scheduler.restore({
+            "tts": (self.tts_log_write, self.set_last_audio),
+            "batch": (self.batch_log_write, None),
+        }, self.settings)
+        self.refresh_queue()
+
     def apply_dark_theme(self, root):
         style = ttk.Style(root)
         style.theme_use("clam")
@@ -537,6 +2451,16 @@ class SpeakVaultApp:
         self.global_stretch_cb = ttk.Checkbutton(self.param_frame, text="Dopasuj audio do czasu SRT/filmu (globalne tempo)", variable=self.global_stretch_var)
         self.global_stretch_cb.pack(anchor="w", pady=(2,0))
 
+        self.tts_loudness_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.param_frame, text="Normalizacja głośności EBU R128 (zastępuje głośność)", variable=self.tts_loudness_var).pack(anchor="w", pady=(2,0))
+        ttk.Label(self.param_frame, text="Docelowa głośność (LUFS, np. -23, -16):").pack(anchor="w", pady=(2,0))
+        self.tts_loudness_target_var = tk.DoubleVar(value=DEFAULT_LOUDNESS_TARGET)
+        ttk.Entry(self.param_frame, textvariable=self.tts_loudness_target_var).pack(fill="x")
+
+        ttk.Label(self.param_frame, text="Priorytet zadania w kolejce (wyższy = wcześniej):").pack(anchor="w", pady=(2,0))
+        self.tts_priority_var = tk.IntVar(value=0)
+        ttk.Entry(self.param_frame, textvariable=self.tts_priority_var).pack(fill="x")
+
         self.engine_option_frame = ttk.Frame(left)
         self.engine_option_frame.pack(fill="x", pady=(10,0))
         self.voice_label = ttk.Label(self.engine_option_frame, text="Wybierz głos Windows TTS")
@@ -547,6 +2471,8 @@ class SpeakVaultApp:
         self.eleven_voice_label = ttk.Label(self.engine_option_frame, text="ElevenLabs Voice ID:")
         self.eleven_voice_var = tk.StringVar()
         self.eleven_voice_entry = ttk.Entry(self.engine_option_frame, textvariable=self.eleven_voice_var)
+        self.eleven_passthrough_var = tk.BooleanVar(value=True)
+        self.eleven_passthrough_cb = ttk.Checkbutton(self.engine_option_frame, text="Zapisuj plik z API bez ponownego kodowania (gdy tempo/ton/głośność = 1.0)", variable=self.eleven_passthrough_var)
         self.coqui_speaker_label = ttk.Label(self.engine_option_frame, text="Coqui Speaker (opcjonalnie):")
         self.coqui_speaker_var = tk.StringVar()
         self.coqui_speaker_entry = ttk.Entry(self.engine_option_frame, textvariable=self.coqui_speaker_var)
@@ -611,8 +2537,15 @@ class SpeakVaultApp:
         ttk.Button(file_row, text="Dodaj pliki audio", command=self.add_batch_files).pack(side="left")
         ttk.Button(file_row, text="Dodaj folder audio", command=self.add_batch_folder).pack(side="left", padx=5)
         ttk.Label(file_row, text="Wybrane pliki:").pack(side="left", padx=10)
-        self.batch_files_box = tk.Listbox(frame, height=6, selectmode="extended", bg="#181e22", fg="#62ffb3", font=("Consolas", 11))
+        self.batch_count_label = ttk.Label(file_row, text="0")
+        self.batch_count_label.pack(side="left")
+        self.batch_files = []
+        self.batch_files_set = set()
+        self.batch_scan_queue = queue.Queue()
+        self.batch_scans = 0
+        self.batch_files_box = VirtualFileList(frame, self.batch_files, height=6, bg="#181e22", fg="#62ffb3", font=("Consolas", 11))
         self.batch_files_box.pack(fill="x", pady=2)
+        self.batch_files_box.refresh()
 
         out_row = ttk.Frame(frame)
         out_row.pack(fill="x", pady=3)
@@ -650,8 +2583,22 @@ class SpeakVaultApp:
         self.batch_end_var = tk.DoubleVar(value=0)
         ttk.Entry(opt_frm, textvariable=self.batch_end_var, width=7).grid(row=6, column=1, sticky="w")
 
+        ttk.Label(opt_frm, text="Priorytet zadania w kolejce:").grid(row=7, column=0, sticky="w")
+        self.batch_priority_var = tk.IntVar(value=0)
+        ttk.Entry(opt_frm, textvariable=self.batch_priority_var, width=7).grid(row=7, column=1, sticky="w")
+
+        self.batch_loudness_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(opt_frm, text="Normalizacja głośności EBU R128 (LUFS):", variable=self.batch_loudness_var).grid(row=8, column=0, sticky="w")
+        self.batch_loudness_target_var = tk.DoubleVar(value=DEFAULT_LOUDNESS_TARGET)
+        ttk.Entry(opt_frm, textvariable=self.batch_loudness_target_var, width=7).grid(row=8, column=1, sticky="w")
+
+        self.batch_streaming_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(opt_frm, text="Tryb strumieniowy (bardzo długie pliki – stałe zużycie pamięci)",
+                        variable=self.batch_streaming_var).grid(row=9, column=0, columnspan=2, sticky="w")
+
         batch_btnrow = ttk.Frame(frame); batch_btnrow.pack(pady=7, fill="x")
         ttk.Button(batch_btnrow, text="Start batch audio", command=self.start_batch).pack(side="left", padx=2)
+        ttk.Button(batch_btnrow, text="Zatrzymaj", command=self.stop_batch).pack(side="left", padx=2)
         ttk.Button(batch_btnrow, text="Resetuj", command=self.reset_app).pack(side="left", padx=2)
         ttk.Button(batch_btnrow, text="Odtwórz wybrany plik", command=self.play_selected_batch_audio).pack(side="left", padx=2)
 
@@ -660,22 +2607,58 @@ class SpeakVaultApp:
         self.batch_log = tk.Text(log_frame, height=13, bg="#181e22", fg="#62ffb3", font=("Consolas", 11), relief="flat", insertbackground="#62ffb3")
         self.batch_log.pack(fill="both", expand=True, padx=4, pady=4)
 
+    def add_batch_paths(self, paths):
+        added = 0
+        for f in paths:
+            if f not in self.batch_files_set:
+                self.batch_files_set.add(f)
+                self.batch_files.append(f)
+                added += 1
+        if added:
+            self.batch_files_box.refresh()
+            self.batch_count_label.config(text=str(len(self.batch_files)))
+        return added
+
     def add_batch_files(self):
         files = filedialog.askopenfilenames(filetypes=[("Audio files", "*.ogg *.mp3 *.wav"), ("All files", "*.*")])
-        for f in files:
-            if f not in self.batch_files:
-                self.batch_files.append(f)
-                self.batch_files_box.insert("end", f)
+        self.add_batch_paths(files)
 
     def add_batch_folder(self):
         folder = filedialog.askdirectory()
-        if folder:
-            for f in os.listdir(folder):
-                if f.lower().endswith((".ogg", ".mp3", ".wav")):
-                    full = os.path.join(folder, f)
-                    if full not in self.batch_files:
-                        self.batch_files.append(full)
-                        self.batch_files_box.insert("end", full)
+        if not folder:
+            return
+        # Skanowanie w tle (rekurencyjnie), GUI dokłada znalezione pliki paczkami
+        def scan():
+            batch = []
+            for entry in iter_files(folder, AUDIO_EXTENSIONS):
+                batch.append(entry.path)
+                if len(batch) >= 500:
+                    self.batch_scan_queue.put(batch)
+                    batch = []
+            self.batch_scan_queue.put(batch)
+            self.batch_scan_queue.put(None)
+        self.batch_scans += 1
+        self.batch_log_write(f"Skanuję folder: {folder}")
+        threading.Thread(target=scan, daemon=True).start()
+        if self.batch_scans == 1:
+            self.root.after(50, self.poll_batch_scan)
+
+    def poll_batch_scan(self):
+        paths = []
+        while True:
+            try:
+                batch = self.batch_scan_queue.get_nowait()
+            except queue.Empty:
+                break
+            if batch is None:
+                self.batch_scans -= 1
+                if not self.batch_scans:
+                    self.batch_log_write(f"Skanowanie zakończone, plików na liście: {len(self.batch_files)}")
+            else:
+                paths.extend(batch)
+        self.add_batch_paths(paths)
+        if self.batch_scans:
+            self.root.after(50, self.poll_batch_scan)
 
     def pick_batch_outdir(self):
         folder = filedialog.askdirectory()
@@ -713,6 +2696,7 @@ class SpeakVaultApp:
             self.eleven_api_entry.pack(fill="x")
             self.eleven_voice_label.pack(anchor="w", pady=(6,0))
             self.eleven_voice_entry.pack(fill="x")
+            self.eleven_passthrough_cb.pack(anchor="w", pady=(6,0))
         elif engine == "Coqui TTS":
             self.coqui_speaker_label.pack(anchor="w")
             self.coqui_speaker_entry.pack(fill="x")
@@ -732,7 +2716,6 @@ class SpeakVaultApp:
         if folder: self.out_var.set(folder)
 
     def start_tts_task(self):
-        stop_event.clear()
         if not self.out_var.get() or not os.path.isdir(self.out_var.get()):
             messagebox.showerror("Błąd", "Musisz wybrać istniejący folder wyjściowy audio!")
             return
@@ -748,22 +2731,66 @@ class SpeakVaultApp:
             "eleven_api_key": self.eleven_api_var.get() if self.engine_var.get() == "ElevenLabs" else "",
             "eleven_voice_id": self.eleven_voice_var.get() if self.engine_var.get() == "ElevenLabs" else "",
             "coqui_speaker": self.coqui_speaker_var.get() if self.engine_var.get() == "Coqui TTS" else "",
+            "eleven_passthrough": self.eleven_passthrough_var.get(),
+            "codec_settings": self.codec_settings,
+            "encode_workers": self.encode_workers,
             "tempo": self.tts_tempo_var.get(),
             "pitch": self.tts_pitch_var.get(),
             "gain": self.tts_gain_var.get(),
             "srt_1s_ciszy": self.srt_1s_ciszy.get(),
             "global_stretch": self.global_stretch_var.get(),
+            "loudness_normalize": self.tts_loudness_var.get(),
+            "loudness_target": self.tts_loudness_target_var.get(),
         }
-        self.tts_log.delete("1.0", "end")
-        self.tts_log.insert("end", f"--- Start zadania: {task['file']}, silnik: {task['engine']} ---\n")
-        threading.Thread(target=generate_audio_task, args=(task, self.tts_log_write, self.set_last_audio), daemon=True).start()
+        task.update(self.pipeline_settings)
+        job_id = self.scheduler.submit("tts", task, self.tts_log_write, self.set_last_audio, self.tts_priority_var.get())
+        self.tts_log.insert("end", f"--- Zadanie #{job_id} w kolejce: {task['file']}, silnik: {task['engine']} ---\n")
 
     def set_last_audio(self, path):
         self.last_audio_path = path
 
     def stop_tts_task(self):
-        stop_event.set()
-        self.tts_log_write("🛑 Zadanie oznaczone do zatrzymania.")
+        n = self.scheduler.cancel_running("tts")
+        self.tts_log_write(f"🛑 Trwające zadania oznaczone do zatrzymania: {n} (kolejka – zakładka „Kolejka zadań”)")
+
+    def stop_batch(self):
+        n = self.scheduler.cancel_running("batch")
+        self.batch_log_write(f"🛑 Trwające zadania batch oznaczone do zatrzymania: {n} (kolejka – zakładka „Kolejka zadań”)")
+
+    def build_queue_tab(self, frame):
+        self.add_credit(frame)
+        ttk.Label(frame, text="Zadania w kolejce i w trakcie:", font=("Segoe UI", 12, "bold")).pack(anchor="w", padx=10, pady=7)
+        columns = ("id", "kind", "engine", "priority", "status", "name")
+        self.queue_tree = ttk.Treeview(frame, columns=columns, show="headings", height=20)
+        for col, title, width in zip(columns, ("#", "Typ", "Silnik", "Priorytet", "Status", "Plik"), (50, 70, 120, 80, 110, 400)):
+            self.queue_tree.heading(col, text=title)
+            self.queue_tree.column(col, width=width, anchor="w")
+        self.queue_tree.pack(fill="both", expand=True, padx=10, pady=5)
+        queue_btnrow = ttk.Frame(frame); queue_btnrow.pack(pady=7, fill="x")
+        ttk.Button(queue_btnrow, text="Zatrzymaj zaznaczone", command=self.cancel_selected_jobs).pack(side="left", padx=2)
+        ttk.Button(queue_btnrow, text="Wyczyść całą kolejkę", command=self.cancel_all_jobs).pack(side="left", padx=2)
+
+    def refresh_queue(self):
+        statuses = {"pending": "oczekuje", "running": "w trakcie", "stopping": "zatrzymywanie"}
+        selected = set(self.queue_tree.selection())
+        self.queue_tree.delete(*self.queue_tree.get_children())
+        for job in self.scheduler.list_jobs():
+            iid = str(job["id"])
+            self.queue_tree.insert("", "end", iid=iid, values=(job["id"], job["kind"], job["engine"], job["priority"],
+                                                               statuses.get(job["status"], job["status"]), job["name"]))
+            if iid in selected:
+                self.queue_tree.selection_add(iid)
+        self.root.after(1000, self.refresh_queue)
+
+    def cancel_selected_jobs(self):
+        for iid in self.queue_tree.selection():
+            if self.scheduler.cancel(int(iid)):
+                log_event(f"Zadanie #{iid} zatrzymane z listy zadań")
+
+    def cancel_all_jobs(self):
+        if messagebox.askyesno("Kolejka zadań", "Zatrzymać wszystkie zadania, także oczekujące w kolejce?"):
+            n = self.scheduler.cancel_all()
+            log_event(f"Wyczyszczono kolejkę: {n} zadań")
 
     def reset_app(self):
         self.root.destroy()
@@ -786,6 +2813,9 @@ class SpeakVaultApp:
             "eleven_api_key": self.eleven_api_var.get(),
             "eleven_voice_id": self.eleven_voice_var.get(),
             "coqui_speaker": self.coqui_speaker_var.get(),
+            "eleven_passthrough": self.eleven_passthrough_var.get(),
+            "codec_settings": {f: codec_settings_for(f, self.codec_settings) for f in SUPPORTED_FORMATS},
+            "encode_workers": self.encode_workers,
             "tempo": self.tts_tempo_var.get(),
             "pitch": self.tts_pitch_var.get(),
             "gain": self.tts_gain_var.get(),
@@ -794,7 +2824,10 @@ class SpeakVaultApp:
             "output_dir": self.out_var.get(),
             "srt_1s_ciszy": self.srt_1s_ciszy.get(),
             "global_stretch": self.global_stretch_var.get(),
+            "loudness_normalize": self.tts_loudness_var.get(),
+            "loudness_target": self.tts_loudness_target_var.get(),
         }
+        settings.update(self.pipeline_settings)
         ok = save_settings(settings, self.settings_path_var.get())
         if ok:
             messagebox.showinfo("Ustawienia", f"Ustawienia zapisane do:\n{self.settings_path_var.get()}")
@@ -809,6 +2842,11 @@ class SpeakVaultApp:
         self.eleven_api_var.set(s.get("eleven_api_key", ""))
         self.eleven_voice_var.set(s.get("eleven_voice_id", ""))
         self.coqui_speaker_var.set(s.get("coqui_speaker", ""))
+        self.eleven_passthrough_var.set(s.get("eleven_passthrough", True))
+        self.codec_settings = s.get("codec_settings", {}) or {}
+        self.encode_workers = int(s.get("encode_workers", DEFAULT_ENCODE_WORKERS))
+        # Wątki etapów potoku i głębokość kolejek – ustawiane tylko w pliku profilu
+        self.pipeline_settings = {k: int(s[k]) for k in ("synth_workers", "dsp_workers", "pipeline_depth") if k in s}
         self.tts_tempo_var.set(s.get("tempo", 1.0))
         self.tts_pitch_var.set(s.get("pitch", 1.0))
         self.tts_gain_var.set(s.get("gain", 1.0))
@@ -817,6 +2855,8 @@ class SpeakVaultApp:
         self.out_var.set(s.get("output_dir", "audio_output"))
         self.srt_1s_ciszy.set(s.get("srt_1s_ciszy", False))
         self.global_stretch_var.set(s.get("global_stretch", False))
+        self.tts_loudness_var.set(s.get("loudness_normalize", False))
+        self.tts_loudness_target_var.set(s.get("loudness_target", DEFAULT_LOUDNESS_TARGET))
         self.sync_merge_and_1s()
         self.on_engine_change()
 
@@ -835,12 +2875,24 @@ class SpeakVaultApp:
         fmt = self.batch_format_var.get()
         start_s = self.batch_start_var.get()
         end_s = self.batch_end_var.get()
-        self.batch_log.delete("1.0", "end")
-        def log(msg):
-            self.batch_log.insert("end", msg + "\n")
-            self.batch_log.see("end")
-            self.batch_log.update_idletasks()
-        threading.Thread(target=batch_audio_task, args=(self.batch_files, outdir, speed, pitch, gain, silence_remove, fmt, start_s, end_s, log), daemon=True).start()
+        task = {
+            "files": list(self.batch_files),
+            "outdir": outdir,
+            "speed": speed,
+            "pitch": pitch,
+            "gain": gain,
+            "silence_remove": silence_remove,
+            "fmt": fmt,
+            "start_s": start_s,
+            "end_s": end_s,
+            "codec_settings": self.codec_settings,
+            "encode_workers": self.encode_workers,
+            "loudness_normalize": self.batch_loudness_var.get(),
+            "loudness_target": self.batch_loudness_target_var.get(),
+            "streaming": self.batch_streaming_var.get(),
+        }
+        job_id = self.scheduler.submit("batch", task, self.batch_log_write, priority=self.batch_priority_var.get())
+        self.batch_log_write(f"--- Zadanie batch #{job_id} w kolejce: {len(task['files'])} plików ---")
 
     def batch_log_write(self, msg):
         self.batch_log.insert("end", msg + "\n")
@@ -885,11 +2937,28 @@ class SpeakVaultApp:
 
     def refresh_events(self):
         self.events_text.delete("1.0", "end")
-        for line in event_log[-250:]:
+        for line in list(event_log)[-250:]:
             self.events_text.insert("end", line + "\n")
         self.events_text.see("end")
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="SpeakVault")
+    parser.add_argument("--watch", metavar="FOLDER", help="tryb bez GUI: obserwuj folder ze skryptami TXT/CSV/SRT")
+    parser.add_argument("--out", metavar="DIR", help="folder wyjściowy audio (domyślnie z pliku ustawień)")
+    parser.add_argument("--settings", default=DEFAULT_SETTINGS_FILE, help="plik ustawień JSON")
+    parser.add_argument("--interval", type=float, default=2.0, help="odstęp sprawdzania folderu w sekundach")
+    parser.add_argument("--serve", action="store_true", help="tryb bez GUI: lokalny serwer HTTP syntezy i batch")
+    parser.add_argument("--host", default=DEFAULT_SERVER_HOST, help="adres serwera HTTP")
+    parser.add_argument("--port", type=int, default=DEFAULT_SERVER_PORT, help="port serwera HTTP")
+    parser.add_argument("--batch-root", metavar="DIR", help="folder, w którym POST /batch może czytać i zapisywać pliki")
+    args = parser.parse_args()
+    if args.watch:
+        run_watch(args.watch, args.out, args.settings, args.interval)
+        sys.exit()
+    if args.serve:
+        run_server(args.host, args.port, args.settings, batch_root=args.batch_root)
+        sys.exit()
     root = tk.Tk()
     app = SpeakVaultApp(root)
     app.fmt_var.set(DEFAULT_FORMAT)